@@ -1,81 +1,557 @@
 #!/usr/bin/env python3
-from gzip import open as gopen
-from treeswift import read_tree_newick,Node
+from array import array
+from compact_tree import CompactTree,iter_newick_strings,parse_newick_compact,read_tree_compact
+from external_sort import chunk_size_for_memory,external_sort
+from heapq import heapify,heappop,nsmallest
+from itertools import islice
+from multiprocessing import Pool
+from os import cpu_count
+from profiling import enable_profiling,get_profiler
+from tree_cache import TreeCache,extend_entry,load_table,load_tree
 from warnings import warn
 
-# sort by edge length, then parent edge length, then grandparent edge length, etc.
-def prioritize(tree,n,diag=None):
-    # compute path-length to root
-    leaves = list(); root_dist = dict(); num_ancestors = dict()
-    for u in tree.traverse_preorder():
-        if u.is_leaf():
-            leaves.append(u)
-        if u.is_root():
-            root_dist[u] = 0; num_ancestors[u] = 0; u.edge_length = 0
+# densely rank a list of comparable keys (equal keys get equal ranks)
+def dense_rank(keys):
+    rank = {k:i for i,k in enumerate(sorted(set(keys)))}
+    return [rank[k] for k in keys]
+
+# compute integer priority keys of all leaves: leaf l is ranked by the infinite sequence (edge length, parent edge length, ..., root edge length, t, t, ...),
+# where t = root_dist(l)/num_ancestors(l), so ProACT order = sort by key, then label/diagnosis. Keys are computed by prefix doubling over root paths:
+# at each round, every window of length 2h is ranked from the ranks of its two halves of length h, so no leaf ever walks its ancestors
+def priority_keys(tree):
+    par = tree.parent; depth = tree.depths(); el = list(tree.edge_lengths_or_zero()); root_dist = tree.root_dists(); leaf_ind = tree.traverse_leaves()[::-1]; tie = list() # scanned in preorder
+    for i in leaf_ind:
+        if depth[i] == 0:
+            tie.append(0)
         else:
-            if u.edge_length is None:
-                u.edge_length = 0
-            root_dist[u] = root_dist[u.parent] + u.edge_length
-            num_ancestors[u] = num_ancestors[u.parent] + 1
+            tie.append(float(root_dist[i])/depth[i])
+    max_depth = max(depth[i] for i in leaf_ind); prof = get_profiler()
+    if prof.enabled: # ancestor-walk depth of each leaf = number of ancestral edges a pairwise comparison could visit
+        prof.observe('leaf_depth', (depth[i] for i in leaf_ind))
+
+    # W[u] = rank of node window (u, parent, ...) of length h (None if it would pass the root), Y[k] = rank of leaf k's window of length h that
+    # starts at the ancestor at depth (depth mod h) (so it reaches the root and is padded with t), T[k] = rank of t repeated h times
+    ranks = dense_rank(el + tie); W = ranks[:len(el)]; T = ranks[len(el):]; Y = [W[0]]*len(leaf_ind); anc = par; h = 1
+    while h < max_depth+2:
+        node_keys = list(); node_ids = list(); leaf_keys = list(); path = [None]*(max_depth+1); k = 0
+        for u in range(len(par)):
+            path[depth[u]] = u
+            if depth[u]+1 >= 2*h:
+                node_ids.append(u); node_keys.append((W[u],W[anc[u]]))
+            if k < len(leaf_ind) and leaf_ind[k] == u:
+                r = depth[u] % (2*h); b = path[r]
+                if r+1 >= h:
+                    first = W[b]
+                else:
+                    first = Y[k]
+                if r+1 > h:
+                    second = Y[k]
+                else:
+                    second = T[k]
+                leaf_keys.append((first,second)); k += 1
+        ranks = dense_rank(node_keys + leaf_keys + [(t,t) for t in T])
+        W = [None]*len(par)
+        for u,r in zip(node_ids,ranks):
+            W[u] = r
+        Y = ranks[len(node_keys):len(node_keys)+len(leaf_ind)]; T = ranks[len(node_keys)+len(leaf_ind):]
+        anc = [-1 if a == -1 else anc[a] for a in anc]; h *= 2; prof.count('doubling_rounds')
+    return Y[::-1] # aligned with tree.traverse_leaves()
+
+# dense ranks of (key..., id) records sorted out of core: out[id] = rank of the record's key (-1 for ids without a record)
+def external_dense_rank(records, size, chunk_size, directory=None, stats=None):
+    out = array('q', [-1])*size; r = -1; prev = None
+    for x in external_sort(records, chunk_size, directory, stats=stats):
+        if x[:-1] != prev:
+            r += 1; prev = x[:-1]
+        out[x[-1]] = r
+    return out
+
+# priority_keys with every dense ranking done by an external sort holding at most chunk_size records in memory, and all per-node state
+# in typed arrays. Ranks of nodes, leaf windows (Y), and pads (T) share one array: ids [0,N) are nodes, [N,N+L) leaves, [N+L,N+2L) pads
+def priority_keys_external(tree, chunk_size, directory=None):
+    N = len(tree); par = tree.parent; depth = tree.depths(); el = tree.edge_lengths_or_zero(); root_dist = tree.root_dists(); cs = tree.child_start
+    leaf_ind = array('l', (i for i in range(N) if cs[i] == cs[i+1])); L = len(leaf_ind); max_depth = max(depth[i] for i in leaf_ind); prof = get_profiler(); stats = dict()
+    def initial_records():
+        for u in range(N):
+            yield (el[u],u)
+        for k,i in enumerate(leaf_ind):
+            yield (0 if depth[i] == 0 else float(root_dist[i])/depth[i], N+L+k)
+    R = external_dense_rank(initial_records(), N+2*L, chunk_size, directory, stats)
+    for k in range(L):
+        R[N+k] = R[0]
+    anc = par; h = 1
+    def records():
+        path = array('l', [0])*(max_depth+1); k = 0
+        for u in range(N):
+            path[depth[u]] = u
+            if depth[u]+1 >= 2*h:
+                yield (R[u],R[anc[u]],u)
+            if k < L and leaf_ind[k] == u:
+                r = depth[u] % (2*h); b = path[r]
+                if r+1 >= h:
+                    first = R[b]
+                else:
+                    first = R[N+k]
+                if r+1 > h:
+                    second = R[N+k]
+                else:
+                    second = R[N+L+k]
+                yield (first,second,N+k); k += 1
+        for k in range(L):
+            yield (R[N+L+k],R[N+L+k],N+L+k)
+    while h < max_depth+2:
+        R = external_dense_rank(records(), N+2*L, chunk_size, directory, stats)
+        anc = array('l', (-1 if a == -1 else anc[a] for a in anc)); h *= 2; prof.count('doubling_rounds')
+    prof.count('sorted_runs', stats.get('runs',0))
+    return R[N:N+L][::-1] # aligned with tree.traverse_leaves()
+
+# yield leaf labels in priority order: leaves are first ordered by fixed-width keys of their first `depth` sequence elements (edge length,
+# parent edge length, ...; t once past the root), and only groups still tied on those are refined: each tied group is extended by the next
+# elements (doubling the width every round) and split again until it is resolved or every member is past the root. If refinement gets too
+# expensive (e.g. long all-equal ladders), the remaining groups are resolved with the exact priority keys. Groups are refined only when they
+# are reached, and with lazy=True they are also popped from a heap instead of fully sorted, so taking the first n costs O(N + n log N) plus
+# the refinement of the groups that overlap the top n. stats (if given) gets 'refined_leaves' (leaves tied on the first `depth` elements
+# that had to be refined), 'refinement_rounds', 'exact_keys'
+BOUNDED_DEPTH = 2
+def iter_refined(tree,diag=None,depth=BOUNDED_DEPTH,stats=None,lazy=False):
+    leaf_ind = tree.traverse_leaves(); labels = [tree.get_label(i) for i in leaf_ind]; L = len(leaf_ind); prof = get_profiler()
+    par = tree.parent; el = tree.edge_lengths_or_zero(); dep = tree.depths(); root_dist = tree.root_dists()
+    tie = [0 if dep[i] == 0 else float(root_dist[i])/dep[i] for i in leaf_ind]; cur = list(leaf_ind) # cur[k] = next ancestor of leaf k (-1 past the root)
+    if diag is None:
+        tie_break = lambda k: (labels[k],k)
+    else:
+        tie_break = lambda k: (diag[labels[k]],k)
+    def extend(k, width): # next `width` sequence elements of leaf k
+        u = cur[k]; out = list()
+        for _ in range(width):
+            if u == -1:
+                out.append(tie[k])
+            else:
+                out.append(el[u]); u = par[u]
+        cur[k] = u
+        return tuple(out)
+    # consecutive runs of equal keys among members sorted by key
+    def groups(members, keys):
+        start = 0
+        for j in range(1,len(members)+1):
+            if j == len(members) or keys[members[j]] != keys[members[start]]:
+                yield members[start:j]; start = j
+    # runs of equal keys popped from a heap of (key, leaf)
+    def heap_groups(heap):
+        heapify(heap)
+        while len(heap) != 0:
+            x,k = heappop(heap); g = [k]
+            while len(heap) != 0 and heap[0][0] == x:
+                g.append(heappop(heap)[1])
+            yield g
+    if stats is None:
+        stats = dict()
+    stats['refined_leaves'] = 0; stats['refinement_rounds'] = 0; stats['exact_keys'] = False
+    budget = [8*L*max(1,L.bit_length())]; exact = [None]
+    def refine(members, width): # exact order of a group tied on every element so far
+        if all(cur[k] == -1 for k in members): # the rest of every sequence is t repeated
+            return sorted(members, key=lambda k: (tie[k],tie_break(k)))
+        budget[0] -= width*len(members)
+        if budget[0] < 0:
+            if exact[0] is None:
+                with prof.phase('priority_keys'):
+                    exact[0] = priority_keys(tree)
+                stats['exact_keys'] = True
+            return sorted(members, key=lambda k: (exact[0][k],tie_break(k)))
+        stats['refinement_rounds'] += 1; prof.count('refinement_rounds'); keys = {k:extend(k,width) for k in members}; out = list()
+        for g in groups(sorted(members, key=keys.__getitem__), keys):
+            if len(g) == 1:
+                out += g
+            else:
+                out += refine(g, 2*width)
+        return out
+    with prof.phase('bounded_keys'):
+        keys = [extend(k,depth) for k in range(L)]
+    if lazy:
+        leaf_groups = heap_groups([(x,k) for k,x in enumerate(keys)])
+    else:
+        with prof.phase('sort'):
+            if prof.count_comparisons: # ties on the bounded keys count as tie-break comparisons
+                order = sorted(range(L), key=lambda k: CountedKey((keys[k],),prof))
+            else:
+                order = sorted(range(L), key=keys.__getitem__)
+        leaf_groups = groups(order, keys)
+    for g in leaf_groups:
+        if len(g) == 1:
+            yield labels[g[0]]
+        else:
+            stats['refined_leaves'] += len(g); prof.count('refined_leaves', len(g))
+            for k in refine(g, max(1,depth)):
+                yield labels[k]
+
+# first n leaves of iter_refined (ranked on the first `depth` sequence elements, refining only tied groups that overlap the top n)
+def prioritize_bounded(tree,n,diag=None,depth=BOUNDED_DEPTH,stats=None):
+    tree = as_compact(tree); L = len(tree.traverse_leaves())
+    if n == 'All':
+        n = L
+    else:
+        n = int(n)
+    if n < 0 or n > L:
+        raise ValueError("Number of output individuals (%d) must be less than or equal to total number of individuals in tree (%d)" % (n,L))
+    return list(islice(iter_refined(tree,diag,depth,stats,lazy=n < L), n))
+
+# same order as prioritize (a generator of labels), but out of core: keys are computed by priority_keys_external (unless given) and the
+# leaves are ranked by an external sort, with about memory_mb of sort buffers (the tree itself is kept in its compact arrays)
+def prioritize_external(tree,n,diag=None,memory_mb=1024,directory=None,keys=None):
+    tree = as_compact(tree); leaf_ind = tree.traverse_leaves(); chunk_size = chunk_size_for_memory(memory_mb); prof = get_profiler()
+    if n == 'All':
+        n = len(leaf_ind)
+    else:
+        n = int(n)
+    if n < 0 or n > len(leaf_ind):
+        raise ValueError("Number of output individuals (%d) must be less than or equal to total number of individuals in tree (%d)" % (n,len(leaf_ind)))
+    if keys is None:
+        with prof.phase('priority_keys'):
+            keys = priority_keys_external(tree, chunk_size, directory)
+    if diag is None:
+        records = ((keys[k],tree.get_label(i),k) for k,i in enumerate(leaf_ind))
+    else:
+        records = ((keys[k],diag[tree.get_label(i)],k) for k,i in enumerate(leaf_ind))
+    for j,x in enumerate(external_sort(records, chunk_size, directory)):
+        if j == n:
+            break
+        yield tree.get_label(leaf_ind[x[-1]])
+
+# TreeSwift trees are flattened once, CompactTree objects are used as-is
+def as_compact(tree):
+    if isinstance(tree,CompactTree):
+        return tree
+    return CompactTree.from_treeswift(tree)
+
+# sort key of leaf i: ProACT key, then label/diagnosis, then position in tree.traverse_leaves() (TreeSwift's preorder, so ties keep the order of
+# a stable sort of TreeSwift leaves)
+def leaf_sort_keys(labels,keys,diag=None):
+    if diag is None:
+        return [(keys[i],l,i) for i,l in enumerate(labels)]
+    else:
+        return [(keys[i],diag[l],i) for i,l in enumerate(labels)]
+
+# sort key wrapper that counts comparisons (only used when profiling with count_comparisons)
+class CountedKey:
+    __slots__ = ('key','prof')
+    def __init__(self, key, prof):
+        self.key = key; self.prof = prof
+
+    def __lt__(self, other):
+        self.prof.count('sort_comparisons')
+        if self.key[0] == other.key[0]: # ProACT keys tie: decided by label/diagnosis (or tree order)
+            self.prof.count('tie_break_comparisons')
+        return self.key < other.key
+
+# sort by edge length, then parent edge length, then grandparent edge length, etc. (use dist to root once ancestors run out), then label/diagnosis.
+# Leaves are ranked by iter_refined (so only ties on the first few edges are refined, and only within the top n), unless precomputed priority
+# keys (e.g. from the cache) are passed in, which are sorted directly
+def prioritize(tree,n,diag=None,keys=None):
+    if keys is None:
+        return prioritize_bounded(tree,n,diag)
+    tree = as_compact(tree); leaves = [tree.get_label(i) for i in tree.traverse_leaves()]; prof = get_profiler()
     if n == 'All':
         n = len(leaves)
     else:
         n = int(n)
     if n < 0 or n > len(leaves):
         raise ValueError("Number of output individuals (%d) must be less than or equal to total number of individuals in tree (%d)" % (n,len(leaves)))
-    # sort by edge length, then parent edge length, then grandparent edge length, etc. (use dist to root once ancestors run out)
-    def compare(l1,l2):
-        tie1 = float(root_dist[l1])/num_ancestors[l1]; tie2 = float(root_dist[l2])/num_ancestors[l2]
-        c1 = l1; c2 = l2
-        c1l = c1.edge_length; c2l = c2.edge_length
+    with prof.phase('sort_keys'): # includes diagnosis lookup
+        sort_keys = leaf_sort_keys(leaves,keys,diag)
+    with prof.phase('sort'):
+        if prof.count_comparisons:
+            sort_keys = [CountedKey(k,prof) for k in sort_keys]
+        if n == len(leaves):
+            top = sorted(sort_keys)
+        else: # partial selection: O(N log n) instead of a full sort
+            top = nsmallest(n,sort_keys)
+        if prof.count_comparisons:
+            top = [k.key for k in top]
+    return [leaves[k[-1]] for k in top]
+
+# yield leaves in priority order lazily (groups are popped from a heap and refined as they are reached), so callers can pull batches and stop
+# early without ranking every leaf
+def iter_prioritized(tree,diag=None):
+    return iter_refined(as_compact(tree),diag,lazy=True)
+
+# sorted sequence split into blocks, so an item can be inserted, removed, or ranked in O(sqrt(n)) without re-sorting (order-maintenance list)
+class BlockList:
+    def __init__(self, items, block_size=512):
+        self.block_size = block_size; self.blocks = [items[i:i+block_size] for i in range(0,len(items),block_size)]; self.block_of = dict()
+        for b in self.blocks:
+            for x in b:
+                self.block_of[x] = b
+
+    def __len__(self):
+        return len(self.block_of)
+
+    def __iter__(self):
+        for b in self.blocks:
+            for x in b:
+                yield x
+
+    def block_index(self, b):
+        for i,c in enumerate(self.blocks):
+            if c is b:
+                return i
+
+    # 0-based position of x
+    def rank(self, x):
+        b = self.block_of[x]; i = self.block_index(b)
+        return sum(len(c) for c in self.blocks[:i]) + next(j for j,y in enumerate(b) if y is x)
+
+    def remove(self, x):
+        b = self.block_of.pop(x); del b[next(j for j,y in enumerate(b) if y is x)]
+        if len(b) == 0:
+            del self.blocks[self.block_index(b)]
+
+    # insert x after every item y with not less(x,y)
+    def insert(self, x, less):
+        lo = 0; hi = len(self.blocks)
+        while lo < hi: # first block whose last item is greater than x
+            mid = (lo+hi)//2
+            if less(x,self.blocks[mid][-1]):
+                hi = mid
+            else:
+                lo = mid+1
+        if lo == len(self.blocks):
+            if lo == 0:
+                self.blocks.append([])
+            lo -= 1
+        b = self.blocks[lo]; i = 0; j = len(b)
+        while i < j:
+            mid = (i+j)//2
+            if less(x,b[mid]):
+                j = mid
+            else:
+                i = mid+1
+        b.insert(i,x); self.block_of[x] = b
+        if len(b) > 2*self.block_size:
+            c = b[self.block_size:]; del b[self.block_size:]; self.blocks.insert(lo+1,c)
+            for y in c:
+                self.block_of[y] = c
+
+# ProACT ranking of a TreeSwift tree that is updated in place when leaves are grafted, removed, or edge lengths change: only leaves below the
+# modified nodes are re-ranked (binary insertion with the ancestral edge length comparison), so the cost scales with the update, not the tree
+class IncrementalPrioritizer:
+    def __init__(self, tree, diag=None):
+        self.tree = tree; self.diag = diag; self.tie = dict()
+        ct = CompactTree.from_treeswift(tree); leaves = [u for u in tree.traverse_preorder() if u.is_leaf()]
+        depth = ct.depths(); root_dist = ct.root_dists()
+        for u,i in zip(leaves,ct.traverse_leaves()):
+            if depth[i] == 0:
+                self.tie[u] = 0
+            else:
+                self.tie[u] = float(root_dist[i])/depth[i]
+        self.order = BlockList([leaves[k[-1]] for k in sorted(leaf_sort_keys([u.label for u in leaves],priority_keys(ct),diag))])
+
+    # edge length as used by ProACT (missing and root edges count as 0)
+    @staticmethod
+    def edge_length(u):
+        if u.is_root() or u.edge_length is None:
+            return 0
+        return u.edge_length
+
+    # root_dist/num_ancestors of leaf u (summed from the root down, like CompactTree.root_dists)
+    def compute_tie(self, u):
+        path = list(u.traverse_ancestors(include_self=True))[:-1]; dist = 0.
+        for v in reversed(path):
+            dist += self.edge_length(v)
+        if len(path) == 0:
+            return 0
+        return dist/len(path)
+
+    # ProACT comparison of two leaves: edge length, parent edge length, ..., then root_dist/num_ancestors once ancestors run out, then label/diagnosis
+    def less(self, l1, l2):
+        c1 = l1; c2 = l2; c1l = self.edge_length(l1); c2l = self.edge_length(l2); prof = get_profiler()
+        if prof.enabled:
+            prof.count('incremental_comparisons')
         while c1l == c2l:
+            if prof.enabled:
+                prof.count('ancestor_walk_steps')
             if c1 is None and c2 is None:
-                if diag is None:
-                    return l1.label < l2.label
+                if self.diag is None:
+                    t1 = l1.label; t2 = l2.label
                 else:
-                    return diag[l1.label] < diag[l2.label]
+                    t1 = self.diag[l1.label]; t2 = self.diag[l2.label]
+                if t1 == t2:
+                    return self.preorder_before(l1,l2)
+                return t1 < t2
             if c1 is not None:
                 if c1.parent is None:
-                    c1l = tie1; c1 = None
+                    c1l = self.tie[l1]; c1 = None
                 else:
-                    c1 = c1.parent; c1l = c1.edge_length
+                    c1 = c1.parent; c1l = self.edge_length(c1)
             if c2 is not None:
                 if c2.parent is None:
-                    c2l = tie2; c2 = None
+                    c2l = self.tie[l2]; c2 = None
                 else:
-                    c2 = c2.parent; c2l = c2.edge_length
+                    c2 = c2.parent; c2l = self.edge_length(c2)
         return c1l < c2l
-    Node.__lt__ = lambda self,other: compare(self,other)
-    return [l.label for l in sorted(leaves)[:n]]
 
-def read_diagnosis(filename):
-    if filename.lower().endswith('.gz'):
-        lines = gopen(filename).read().decode().strip().splitlines()
-    else:
-        lines = open(filename).read().strip().splitlines()
-    diag = dict()
-    for l in lines:
-        u,t = l.split('\t'); diag[u.strip()] = float(t)
-    return diag
+    # True if u comes before v in TreeSwift's preorder (which visits the last child first), the final tie-breaker of prioritize
+    @staticmethod
+    def preorder_before(u, v):
+        path_u = list(u.traverse_ancestors(include_self=True))[::-1]; path_v = list(v.traverse_ancestors(include_self=True))[::-1]; i = 0
+        while i < min(len(path_u),len(path_v)) and path_u[i] is path_v[i]:
+            i += 1
+        if i == len(path_u) or i == len(path_v): # one is an ancestor of the other
+            return len(path_u) < len(path_v)
+        siblings = path_u[i-1].children
+        return next(j for j,c in enumerate(siblings) if c is path_u[i]) > next(j for j,c in enumerate(siblings) if c is path_v[i])
+
+    # re-rank after the tree was modified: changed = nodes that were added or whose edge length changed (including internal nodes created by
+    # grafting), removed = leaves that were pruned. Returns (label, old rank, new rank) of every re-ranked leaf whose rank changed (None = absent)
+    def update(self, changed=(), removed=()):
+        affected = {l for u in changed for l in u.traverse_leaves()}; old_rank = dict()
+        for u in list(affected) + list(removed):
+            if u in self.order.block_of:
+                old_rank[u] = self.order.rank(u)
+        for u in old_rank:
+            self.order.remove(u)
+        for u in removed:
+            self.tie.pop(u,None)
+        for u in affected:
+            self.tie[u] = self.compute_tie(u)
+            self.order.insert(u,self.less)
+        moved = list()
+        for u in list(affected) + [u for u in removed if u not in affected]:
+            r = None
+            if u in affected:
+                r = self.order.rank(u)
+            if old_rank.get(u) != r:
+                moved.append((u.label,old_rank.get(u),r))
+        return sorted(moved, key=lambda x: (x[2] is None, x[2]))
+
+    # labels of the top n leaves (all leaves by default)
+    def top(self, n=None):
+        out = list()
+        for u in self.order:
+            if n is not None and len(out) == n:
+                break
+            out.append(u.label)
+        return out
+
+# make sure every leaf of the tree has a diagnosis time
+def check_diagnosis(tree,diag):
+    for l in tree.traverse_leaves():
+        if tree.get_label(l) not in diag:
+            raise RuntimeError("Diagnosis file is missing time for individual: %s" % tree.get_label(l))
+
+# batch worker: the diagnosis map is sent once per worker process (not once per tree)
+BATCH_DIAG = None
+def init_batch_worker(diag):
+    global BATCH_DIAG; BATCH_DIAG = diag
+
+# batch worker: full ProACT ranking of one Newick string
+def prioritize_newick(newick):
+    tree = parse_newick_compact(newick)
+    if BATCH_DIAG is not None:
+        check_diagnosis(tree,BATCH_DIAG)
+    return prioritize(tree,'All',BATCH_DIAG)
+
+# median of a {value: count} histogram
+def hist_median(hist):
+    total = sum(hist.values()); lo = (total-1)//2; hi = total//2; seen = 0; out = list()
+    for v in sorted(hist):
+        while len(out) < 2 and (lo if len(out) == 0 else hi) < seen+hist[v]:
+            out.append(v)
+        seen += hist[v]
+    return (out[0]+out[1])/2
+
+# rank across many trees (e.g. bootstrap or posterior samples) in a process pool and aggregate the per-tree ranks (1 = highest priority) into
+# (label, mean rank, median rank, frequency in top n, number of trees) sorted by mean rank. Trees are consumed in batches and only per-individual
+# rank histograms are kept, so memory does not grow with the number of trees
+def prioritize_batch(trees,n='All',diag=None,processes=None,batch_size=None):
+    rank_sum = dict(); rank_hist = dict(); top_count = dict(); num_trees = dict()
+    if batch_size is None:
+        batch_size = 4*(processes or cpu_count())
+    with Pool(processes, initializer=init_batch_worker, initargs=(diag,)) as pool:
+        trees = iter(trees)
+        for batch in iter(lambda: list(islice(trees,batch_size)), []):
+            for order in pool.imap(prioritize_newick,batch):
+                if n == 'All':
+                    top = len(order)
+                else:
+                    top = int(n)
+                if top < 0 or top > len(order):
+                    raise ValueError("Number of output individuals (%d) must be less than or equal to total number of individuals in tree (%d)" % (top,len(order)))
+                for r,u in enumerate(order):
+                    if u not in rank_sum:
+                        rank_sum[u] = 0; rank_hist[u] = dict(); top_count[u] = 0; num_trees[u] = 0
+                    rank_sum[u] += r+1; rank_hist[u][r+1] = rank_hist[u].get(r+1,0) + 1; num_trees[u] += 1
+                    if r < top:
+                        top_count[u] += 1
+    out = [(u, rank_sum[u]/num_trees[u], hist_median(rank_hist[u]), top_count[u]/num_trees[u], num_trees[u]) for u in rank_sum]
+    return sorted(out, key=lambda x: (x[1],x[2],x[0]))
+
+# stream the diagnosis TSV line by line (plain-text or gzipped), or load its columns from the cache
+def read_diagnosis(filename,cache=None):
+    names,times = load_table(filename,cache)
+    return dict(zip(names,times))
+
+# load the tree (and its priority keys) from the cache, computing and storing whatever is missing
+def load_cached_tree(filename,cache):
+    tree,names,entry = load_tree(filename,cache)
+    if 'keys' not in entry:
+        extend_entry(cache, entry, {'keys':array('q', priority_keys(tree))})
+    return tree,entry['keys']
 
 # run ProACT
 if __name__ == "__main__":
-    import argparse
+    import argparse; from sys import stderr
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-t', '--tree', required=True, type=str, help="Input Tree File (Newick format)")
     parser.add_argument('-d', '--diagnosis', required=False, type=str, default=None, help="Diagnosis File (TSV format)")
     parser.add_argument('-n', '--number', required=False, type=str, default='All', help="Number of Individuals")
     parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File")
+    parser.add_argument('-b', '--batch', action='store_true', help="Input Tree File has multiple trees (one per line): output consensus ranks")
+    parser.add_argument('-p', '--processes', required=False, type=int, default=None, help="Number of Worker Processes (batch mode)")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (reuse parsed tree, diagnosis times, and priority keys across runs)")
+    parser.add_argument('-cs', '--cache_size', required=False, type=int, default=16, help="Maximum Number of Cache Entries")
+    parser.add_argument('-k', '--key_depth', required=False, type=int, default=None, help="Rank on the First K Sequence Elements, then Refine Tied Groups Exactly (reports refined leaves)")
+    parser.add_argument('-M', '--memory', required=False, type=float, default=None, help="Rank Out of Core with about this many MB of Sort Buffers (temporary files in -T)")
+    parser.add_argument('-T', '--tmpdir', required=False, type=str, default=None, help="Directory for Temporary Sort Files (out-of-core mode)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings, peak RSS, sort statistics)")
+    parser.add_argument('-pc', '--profile_comparisons', action='store_true', help="Count Sort Comparisons when Profiling (slows down the sort)")
     args = parser.parse_args()
+    prof = enable_profiling(args.profile, args.profile_comparisons)
+    cache = None
+    if args.cache is not None:
+        cache = TreeCache(args.cache, args.cache_size)
     if args.output == 'stdout':
         from sys import stdout; output = stdout
     else:
         output = open(args.output,'w')
-    tree = read_tree_newick(args.tree)
     if args.diagnosis is not None:
-        args.diagnosis = read_diagnosis(args.diagnosis)
-        for l in tree.traverse_leaves():
-            if l.label not in args.diagnosis:
-                raise RuntimeError("Diagnosis file is missing time for individual: %s" % l.label)
-    for u in prioritize(tree,args.number,args.diagnosis):
-        output.write(u); output.write('\n')
+        with prof.phase('read_diagnosis'):
+            args.diagnosis = read_diagnosis(args.diagnosis,cache)
+    if args.batch:
+        with prof.phase('prioritize_batch'):
+            out = prioritize_batch(iter_newick_strings(args.tree),args.number,args.diagnosis,args.processes)
+        with prof.phase('write_output'):
+            output.write('Individual\tMeanRank\tMedianRank\tTopNFrequency\tNumTrees\n')
+            for u,mean,median,freq,num in out:
+                output.write('%s\t%f\t%s\t%f\t%d\n' % (u,mean,median,freq,num))
+    else:
+        with prof.phase('parse_tree'):
+            if cache is None:
+                tree = read_tree_compact(args.tree); keys = None
+            else:
+                tree,keys = load_cached_tree(args.tree,cache)
+        if args.diagnosis is not None:
+            with prof.phase('check_diagnosis'):
+                check_diagnosis(tree,args.diagnosis)
+        if args.key_depth is not None:
+            stats = dict()
+            with prof.phase('prioritize'):
+                order = prioritize_bounded(tree,args.number,args.diagnosis,args.key_depth,stats)
+            stderr.write("Refined %d of %d leaves (tied on the first %d sequence elements)%s\n" % (stats['refined_leaves'], len(tree.traverse_leaves()), args.key_depth, '; used exact priority keys' if stats['exact_keys'] else ''))
+        elif args.memory is None:
+            with prof.phase('prioritize'):
+                order = prioritize(tree,args.number,args.diagnosis,keys)
+        else: # labels are streamed out of the final merge
+            order = prioritize_external(tree,args.number,args.diagnosis,args.memory,args.tmpdir,keys)
+        with prof.phase('prioritize_and_write' if args.memory is not None else 'write_output'):
+            for u in order:
+                output.write(u); output.write('\n')
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+Check every ProACT ranking entry point against the original comparator (a
+TreeSwift sort by edge length, parent edge length, ..., root_dist/num_ancestors,
+then label or diagnosis time, with remaining ties kept in TreeSwift's preorder)
+on random, polytomy, and ladder trees with tied or missing edge lengths and tied
+diagnosis times, and time both on a ladder tree. Exits with status 1 if any
+ranking differs or prioritize is slower than the original comparator.
+'''
+from compact_tree import CompactTree,read_tree_compact
+from random import Random
+from time import perf_counter
+from treeswift import read_tree_newick
+from ProACT import IncrementalPrioritizer,iter_prioritized,priority_keys,prioritize,prioritize_bounded,prioritize_external
+
+# the original ProACT ranking (a TreeSwift tree is modified in place: missing and root edge lengths become 0)
+def baseline_prioritize(tree,n,diag=None):
+    leaves = list(); root_dist = dict(); num_ancestors = dict()
+    for u in tree.traverse_preorder():
+        if u.is_leaf():
+            leaves.append(u)
+        if u.is_root():
+            root_dist[u] = 0; num_ancestors[u] = 0; u.edge_length = 0
+        else:
+            if u.edge_length is None:
+                u.edge_length = 0
+            root_dist[u] = root_dist[u.parent] + u.edge_length
+            num_ancestors[u] = num_ancestors[u.parent] + 1
+    if n == 'All':
+        n = len(leaves)
+    def compare(l1,l2):
+        tie1 = float(root_dist[l1])/num_ancestors[l1]; tie2 = float(root_dist[l2])/num_ancestors[l2]
+        c1 = l1; c2 = l2
+        c1l = c1.edge_length; c2l = c2.edge_length
+        while c1l == c2l:
+            if c1 is None and c2 is None:
+                if diag is None:
+                    return l1.label < l2.label
+                else:
+                    return diag[l1.label] < diag[l2.label]
+            if c1 is not None:
+                if c1.parent is None:
+                    c1l = tie1; c1 = None
+                else:
+                    c1 = c1.parent; c1l = c1.edge_length
+            if c2 is not None:
+                if c2.parent is None:
+                    c2l = tie2; c2 = None
+                else:
+                    c2 = c2.parent; c2l = c2.edge_length
+        return c1l < c2l
+    class Key:
+        __slots__ = ('u',)
+        def __init__(self, u):
+            self.u = u
+        def __lt__(self, other):
+            return compare(self.u,other.u)
+    return [k.u.label for k in sorted(Key(u) for u in leaves)[:n]]
+
+# random Newick string with num_leaves leaves whose edge lengths are drawn from a few values (so ancestral edge lengths tie often) and are
+# missing with probability p_missing. Shapes: 'random' (2-3 children per node), 'polytomy' (up to 6), or 'ladder' (caterpillar)
+def random_newick(rng, num_leaves, lengths=(0.5,1,2), p_missing=0., shape='random'):
+    def length():
+        return '' if rng.random() < p_missing else ':%s' % rng.choice(lengths)
+    nodes = ['L%d%s' % (i,length()) for i in range(num_leaves)]
+    while len(nodes) > 1:
+        if shape == 'ladder':
+            children = [nodes.pop(), nodes.pop()]
+        else:
+            children = [nodes.pop(rng.randrange(len(nodes))) for _ in range(min(len(nodes),rng.randint(2,6 if shape == 'polytomy' else 3)))]
+        nodes.append('(%s)%s' % (','.join(children),length()))
+    return nodes[0] + ';'
+
+# rankings of every entry point (lists of labels) for a Newick string
+def rankings(s, n, diag):
+    tree = read_tree_compact(s); out = dict()
+    out['prioritize'] = prioritize(tree,n,diag)
+    out['prioritize (from_treeswift)'] = prioritize(CompactTree.from_treeswift(read_tree_newick(s)),n,diag)
+    out['prioritize (priority_keys)'] = prioritize(tree,n,diag,priority_keys(tree))
+    out['prioritize_bounded'] = prioritize_bounded(tree,n,diag,2)
+    out['prioritize_external'] = list(prioritize_external(tree,n,diag,memory_mb=0.001))
+    if n == 'All':
+        out['iter_prioritized'] = list(iter_prioritized(tree,diag)); out['IncrementalPrioritizer'] = IncrementalPrioritizer(read_tree_newick(s),diag).top()
+    return out
+
+# (number of checks, list of (description, newick)) of the rankings that differ from the original comparator
+def check(num_trees=200, max_leaves=40, seed=0):
+    rng = Random(seed); num_checks = 0; failures = list()
+    for i in range(num_trees):
+        shape = ['random','polytomy','ladder'][i % 3]; p_missing = [0.,0.2][(i//3) % 2]; lengths = [(0.5,1,2),(1,)][(i//6) % 2] # (1,): all tied
+        s = random_newick(rng, rng.randint(1,max_leaves), lengths, p_missing, shape); labels = [l.label for l in read_tree_newick(s).traverse_leaves()]
+        diags = [None, {u:2000. for u in labels}, {u:float(rng.randint(2000,2002)) for u in labels}] # none, all tied, mostly tied
+        for d,diag in enumerate(diags):
+            for n in ('All',1,len(labels)//2):
+                expected = baseline_prioritize(read_tree_newick(s),n,diag)
+                for name,order in rankings(s,n,diag).items():
+                    num_checks += 1
+                    if order != expected:
+                        failures.append(('%s, %s tree, n=%s, diagnosis=%d' % (name,shape,n,d), s))
+    return num_checks,failures
+
+# (seconds of the original comparator, seconds of prioritize, same output) on a ladder tree with random edge lengths and diagnosis times (the
+# deep shape where ancestor walks are longest); parsing is not timed
+def check_ladder_timing(num_leaves=20000, seed=0):
+    rng = Random(seed); s = random_newick(rng, num_leaves, tuple(round(rng.expovariate(10),4) for _ in range(1000)), shape='ladder')
+    ts = read_tree_newick(s); tree = read_tree_compact(s); diag = {l.label:float(rng.randint(2000,2010)) for l in ts.traverse_leaves()}
+    start = perf_counter(); expected = baseline_prioritize(ts,'All',diag); baseline_time = perf_counter()-start
+    start = perf_counter(); order = prioritize(tree,'All',diag); new_time = perf_counter()-start
+    return baseline_time,new_time,order == expected
+
+# run main program
+if __name__ == "__main__":
+    import argparse; from sys import exit,stderr
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--num_trees', required=False, type=int, default=200, help="Number of Random Trees")
+    parser.add_argument('-l', '--max_leaves', required=False, type=int, default=40, help="Maximum Number of Leaves per Tree")
+    parser.add_argument('-s', '--seed', required=False, type=int, default=0, help="Random Number Seed")
+    parser.add_argument('-L', '--ladder_leaves', required=False, type=int, default=20000, help="Leaves of the Timed Ladder Tree (0 = skip the timing check)")
+    args = parser.parse_args()
+    num_checks,failures = check(args.num_trees, args.max_leaves, args.seed)
+    for desc,s in failures[:10]:
+        stderr.write("Mismatch (%s): %s\n" % (desc,s))
+    stderr.write("%d of %d rankings differ from the original comparator\n" % (len(failures),num_checks))
+    slow = False
+    if args.ladder_leaves > 0:
+        baseline_time,new_time,same = check_ladder_timing(args.ladder_leaves, args.seed); slow = new_time > baseline_time
+        if not same:
+            failures.append(('ladder timing tree', None))
+        stderr.write("Ladder tree with %d leaves: original comparator %.2fs, prioritize %.2fs%s\n" % (args.ladder_leaves,baseline_time,new_time,'' if same else ' (rankings differ)'))
+    exit(1 if len(failures) != 0 or slow else 0)
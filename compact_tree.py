@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+'''
+Compact array-backed trees: nodes are stored in preorder (so every parent comes
+before its children) in flat arrays of parent index, edge length, and label id,
+with children in CSR form (child offsets + child indices). Trees are read
+straight from Newick (plain or gzipped) without creating Node objects.
+'''
+from array import array
+from gzip import open as gopen
+from math import isnan
+from os.path import expanduser,isfile
+import re
+
+NEWICK_TOKEN = re.compile(r"\s*(?:([(),;])|:\s*([^,();\[\]\s]*)|'((?:[^']|'')*)'|([^,();:\[\]\s']+(?:\s+[^,();:\[\]\s']+)*)|\[[^\]]*\])")
+
+class CompactTree:
+    '''Tree stored in flat arrays with nodes in preorder (root = 0). Missing edge lengths are NaN, missing labels are -1'''
+    def __init__(self, parent, edge_length, label, labels, child_start=None, children=None):
+        self.parent = parent; self.edge_length = edge_length; self.label = label; self.labels = labels
+        if child_start is not None: # CSR arrays already known (e.g. loaded from a cache)
+            self.child_start = child_start; self.children = children; return
+        self.child_start = array('l', [0])*(len(parent)+1)
+        for p in parent:
+            if p != -1:
+                self.child_start[p+1] += 1
+        for i in range(len(parent)):
+            self.child_start[i+1] += self.child_start[i]
+        fill = array('l', self.child_start[:-1]); self.children = array('l', [0])*(len(parent)-1 if len(parent) != 0 else 0)
+        for i,p in enumerate(parent): # preorder, so children end up in Newick order
+            if p != -1:
+                self.children[fill[p]] = i; fill[p] += 1
+
+    # memory-mapped arrays (from the cache) are copied when pickling, so trees can still be sent to worker processes
+    def __getstate__(self):
+        return {k:(array(v.format,v) if isinstance(v,memoryview) else v) for k,v in self.__dict__.items()}
+
+    def __len__(self):
+        return len(self.parent)
+
+    # number of children of node i
+    def num_children(self, i):
+        return self.child_start[i+1] - self.child_start[i]
+
+    # child indices of node i
+    def child_iter(self, i):
+        return self.children[self.child_start[i]:self.child_start[i+1]]
+
+    def is_leaf(self, i):
+        return self.child_start[i] == self.child_start[i+1]
+
+    # label of node i (None if unlabeled)
+    def get_label(self, i):
+        if self.label[i] == -1:
+            return None
+        return self.labels[self.label[i]]
+
+    # edge length of node i (None if missing)
+    def get_edge_length(self, i):
+        if isnan(self.edge_length[i]):
+            return None
+        return self.edge_length[i]
+
+    # parents before children
+    def traverse_preorder(self):
+        return range(len(self.parent))
+
+    # children before parents (reverse preorder)
+    def traverse_postorder(self):
+        return range(len(self.parent)-1, -1, -1)
+
+    # leaf indices in TreeSwift's preorder (which visits the last child first), i.e. in reverse Newick order, so ties keep TreeSwift's order
+    def traverse_leaves(self):
+        cs = self.child_start
+        return [i for i in range(len(self.parent)-1, -1, -1) if cs[i] == cs[i+1]]
+
+    # edge lengths with missing values (and the root's edge) replaced by 0
+    def edge_lengths_or_zero(self):
+        el = array('d', (0. if isnan(x) else x for x in self.edge_length))
+        if len(el) != 0:
+            el[0] = 0.
+        return el
+
+    # number of edges between each node and the root
+    def depths(self):
+        depth = array('l', [0])*len(self.parent)
+        for i in range(1, len(self.parent)):
+            depth[i] = depth[self.parent[i]] + 1
+        return depth
+
+    # path length from the root to each node (missing edge lengths count as 0)
+    def root_dists(self):
+        el = self.edge_lengths_or_zero(); dist = array('d', [0.])*len(self.parent)
+        for i in range(1, len(self.parent)):
+            dist[i] = dist[self.parent[i]] + el[i]
+        return dist
+
+    # convert a TreeSwift tree (no Node objects are kept), numbering nodes in Newick order like parse_newick_compact
+    @staticmethod
+    def from_treeswift(tree):
+        ind = dict(); parent = array('l'); edge_length = array('d'); label = array('l'); labels = list(); label_id = dict(); stack = [tree.root]
+        while len(stack) != 0:
+            u = stack.pop(); stack.extend(reversed(u.children)); ind[u] = len(parent)
+            if u.is_root():
+                parent.append(-1)
+            else:
+                parent.append(ind[u.parent])
+            if u.edge_length is None:
+                edge_length.append(float('nan'))
+            else:
+                edge_length.append(u.edge_length)
+            if u.label is None:
+                label.append(-1)
+            else:
+                if u.label not in label_id:
+                    label_id[u.label] = len(labels); labels.append(u.label)
+                label.append(label_id[u.label])
+        return CompactTree(parent, edge_length, label, labels)
+
+    # Newick string of the tree
+    def newick(self):
+        if len(self.parent) == 0:
+            return ';'
+        out = list(); stack = [(0,False)]
+        while len(stack) != 0:
+            i,closing = stack.pop()
+            if i == -1:
+                out.append(','); continue
+            if not closing and not self.is_leaf(i):
+                out.append('('); stack.append((i,True))
+                for j,c in enumerate(reversed(self.child_iter(i))):
+                    stack.append((c,False))
+                    if j != self.num_children(i)-1:
+                        stack.append((-1,False))
+                continue
+            if closing:
+                out.append(')')
+            if self.label[i] != -1:
+                out.append(str(self.labels[self.label[i]]))
+            if not isnan(self.edge_length[i]):
+                out.append(':%s' % self.edge_length[i])
+        out.append(';')
+        return ''.join(out)
+
+# person name of a leaf label (virus|person|time identifiers)
+def person_name(u):
+    if u.count('|') == 2:
+        return u.split('|')[1]
+    return u
+
+# parse a Newick string into a CompactTree
+def parse_newick_compact(s):
+    parent = array('l'); edge_length = array('d'); label = array('l'); labels = list(); label_id = dict()
+    stack = list(); pending = True; cur = -1
+    def new_node():
+        if len(stack) == 0:
+            if len(parent) != 0:
+                raise RuntimeError("Invalid Newick string: multiple roots")
+            parent.append(-1)
+        else:
+            parent.append(stack[-1])
+        edge_length.append(float('nan')); label.append(-1)
+        return len(parent)-1
+    for m in NEWICK_TOKEN.finditer(s.strip()):
+        sym,length,quoted,name = m.groups()
+        if sym == '(':
+            stack.append(new_node()); pending = True
+        elif sym == ',':
+            if pending:
+                new_node()
+            pending = True
+        elif sym == ')':
+            if pending:
+                new_node()
+            if len(stack) == 0:
+                raise RuntimeError("Invalid Newick string: unbalanced parentheses")
+            cur = stack.pop(); pending = False
+        elif sym == ';':
+            break
+        elif length is not None or quoted is not None or name is not None:
+            if pending:
+                cur = new_node(); pending = False
+            if length is not None:
+                edge_length[cur] = float(length)
+            else:
+                if label[cur] != -1: # e.g. a quoted and an unquoted label (unquoted labels keep their inner whitespace, as in TreeSwift)
+                    raise RuntimeError("Invalid Newick string: multiple labels on one node")
+                if quoted is not None:
+                    name = quoted.replace("''","'")
+                if name not in label_id:
+                    label_id[name] = len(labels); labels.append(name)
+                label[cur] = label_id[name]
+    if len(stack) != 0:
+        raise RuntimeError("Invalid Newick string: unbalanced parentheses")
+    return CompactTree(parent, edge_length, label, labels)
+
+# split a Newick string into pieces that can be parsed independently: runs of consecutive sibling subtrees (each about len(s)/num_pieces
+# bytes) are cut out and replaced by placeholder leaves in a small skeleton tree. Structural characters are located with NumPy; returns
+# (skeleton, placeholder prefix, pieces), or None if the string cannot be split safely (no NumPy, quoted labels or comments, no top-level
+# subtrees). Caterpillar-like trees only split a few levels deep (at most max_descents nodes are opened), so they mostly stay in one piece
+def split_newick(s, num_pieces, max_descents=None):
+    if "'" in s or '[' in s or not s.lstrip().startswith('('):
+        return None
+    try:
+        from numpy import frombuffer,int32,nonzero,searchsorted,uint8
+    except ImportError:
+        return None
+    bs = s.encode(); end = bs.find(b';')
+    if end != -1:
+        bs = bs[:end]
+    arr = frombuffer(bs, dtype=uint8); idx = nonzero((arr == 40) | (arr == 41) | (arr == 44))[0]; vals = arr[idx]
+    depth = ((vals == 40).astype(int32) - (vals == 41)).cumsum(dtype=int32); target = max(1, len(bs)//num_pieces); groups = list()
+    if max_descents is None:
+        max_descents = 4*num_pieces
+    descents = [0]
+    def visit(j): # j = index (in idx) of a '(' whose children are split into groups of consecutive siblings
+        d = depth[j]; close = j + 1 + int(nonzero(depth[j+1:] == d-1)[0][0])
+        commas = j + 1 + nonzero((vals[j+1:close] == 44) & (depth[j+1:close] == d))[0]
+        starts = [int(idx[j])+1] + [int(idx[c])+1 for c in commas]; ends = [int(idx[c]) for c in commas] + [int(idx[close])]; group = None
+        for a,e in zip(starts,ends):
+            if e-a > target and descents[0] < max_descents:
+                k = int(searchsorted(idx, a))
+                if k < close and vals[k] == 40 and bs[a:int(idx[k])].strip() == b'': # large internal child: split it further
+                    if group is not None:
+                        groups.append(group); group = None
+                    descents[0] += 1; visit(k); continue
+            if group is None:
+                group = [a,e]
+            elif e-group[0] > target:
+                groups.append(group); group = [a,e]
+            else:
+                group[1] = e
+        if group is not None:
+            groups.append(group)
+    try:
+        visit(int(searchsorted(idx, len(bs)-len(bs.lstrip()))))
+    except IndexError: # unbalanced parentheses (parse_newick_compact reports the error)
+        return None
+    if len(groups) < 2:
+        return None
+    prefix = 'PIECE'
+    while prefix in s:
+        prefix += '_'
+    skeleton = list(); pieces = list(); last = 0
+    for i,(a,e) in enumerate(groups):
+        skeleton.append(bs[last:a].decode()); skeleton.append('%s%d' % (prefix,i)); pieces.append('(%s);' % bs[a:e].decode()); last = e
+    skeleton.append(bs[last:].decode()); skeleton.append(';')
+    return ''.join(skeleton),prefix,pieces
+
+# parse a Newick string in a process pool (see split_newick), giving the same tree as parse_newick_compact (label ids may be numbered
+# differently). Falls back to parse_newick_compact if the string cannot be split
+def parse_newick_parallel(s, processes=None):
+    from multiprocessing import Pool
+    from os import cpu_count
+    if processes is None:
+        processes = cpu_count()
+    split = split_newick(s, 4*processes) if processes > 1 else None
+    if split is None:
+        return parse_newick_compact(s)
+    skeleton,prefix,pieces = split
+    with Pool(processes) as pool:
+        trees = pool.map(parse_newick_compact, pieces, chunksize=1)
+    sk = parse_newick_compact(skeleton); parent = array('l'); edge_length = array('d'); label = array('l'); labels = list(); label_id = dict()
+    def global_label(name):
+        if name not in label_id:
+            label_id[name] = len(labels); labels.append(name)
+        return label_id[name]
+    piece = [None]*len(sk); new_ind = array('l', [-1])*len(sk) # piece[u] = (piece tree, index offset) if skeleton node u is a placeholder
+    for u in range(len(sk)):
+        name = sk.get_label(u)
+        if sk.is_leaf(u) and name is not None and name.startswith(prefix) and name[len(prefix):].isdigit():
+            piece[u] = (trees[int(name[len(prefix):])],0)
+    # nodes in preorder: each placeholder is replaced by its piece minus the dummy root (piece node i becomes node base+i-1), and the CSR
+    # arrays of each piece are shifted into place instead of being rebuilt
+    child_start = array('l'); children = array('l')
+    for u in range(len(sk)):
+        p = sk.parent[u]
+        if p != -1:
+            p = new_ind[p]
+        if piece[u] is not None:
+            t = piece[u][0]; base = len(parent)-1; piece[u] = (t,base); lm = [global_label(x) for x in t.labels]
+            parent.extend(p if q == 0 else base+q for q in t.parent[1:]); edge_length.extend(t.edge_length[1:]); label.extend(-1 if l == -1 else lm[l] for l in t.label[1:])
+            shift = len(children)-t.child_start[1]; child_start.extend(x+shift for x in t.child_start[1:-1]); children.extend(c+base for c in t.children[t.child_start[1]:])
+        else:
+            new_ind[u] = len(parent); parent.append(p); edge_length.append(sk.edge_length[u]); name = sk.get_label(u); label.append(-1 if name is None else global_label(name))
+            child_start.append(len(children))
+            for c in sk.child_iter(u): # children of a placeholder are not known yet: reserve their slots
+                if piece[c] is None:
+                    children.append(-1)
+                else:
+                    children.extend(array('l', [-1])*piece[c][0].num_children(0))
+    child_start.append(len(children))
+    for u in range(len(sk)): # fill the reserved child slots of skeleton nodes
+        if piece[u] is None:
+            i = child_start[new_ind[u]]
+            for c in sk.child_iter(u):
+                if piece[c] is None:
+                    children[i] = new_ind[c]; i += 1
+                else:
+                    t,base = piece[c]
+                    for r in t.child_iter(0):
+                        children[i] = base+r; i += 1
+    return CompactTree(parent, edge_length, label, labels, child_start, children)
+
+# read a CompactTree from a Newick string or file (plain-text or gzipped). Strings of at least PARALLEL_MIN_LENGTH characters are parsed in
+# a process pool (processes = None: one per CPU; 1: never), except inside worker processes (which cannot start their own pool). A string
+# that is not a file must end with ';' (so a mistyped path is not read as a one-leaf tree)
+PARALLEL_MIN_LENGTH = 1 << 24
+def read_tree_compact(newick, processes=None):
+    if len(newick) < 1000 and isfile(expanduser(newick)):
+        if newick.lower().endswith('.gz'):
+            f = gopen(expanduser(newick), 'rt')
+        else:
+            f = open(expanduser(newick))
+        newick = f.read(); f.close()
+    elif not newick.rstrip().endswith(';'):
+        if len(newick) < 1000 and '(' not in newick:
+            raise RuntimeError("Tree file not found: %s" % newick)
+        raise RuntimeError("Failed to parse string as Newick (missing ';')")
+    if processes != 1 and len(newick) >= PARALLEL_MIN_LENGTH:
+        from multiprocessing import current_process
+        if not current_process().daemon:
+            return parse_newick_parallel(newick, processes)
+    return parse_newick_compact(newick)
+
+# yield the Newick strings of a (possibly huge) multi-tree file one at a time, reading fixed-size chunks (plain-text, gzipped, or stdin)
+def iter_newick_strings(filename, chunk_size=1048576):
+    if filename == 'stdin':
+        from sys import stdin; f = stdin
+    elif filename.lower().endswith('.gz'):
+        f = gopen(expanduser(filename), 'rt')
+    else:
+        f = open(expanduser(filename))
+    pending = list()
+    while True:
+        chunk = f.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        parts = chunk.split(';')
+        for part in parts[:-1]:
+            pending.append(part); tree = ''.join(pending).strip(); pending = list()
+            if len(tree) != 0:
+                yield tree + ';'
+        pending.append(parts[-1])
+    tree = ''.join(pending).strip()
+    if len(tree) != 0:
+        yield tree
+    if filename != 'stdin':
+        f.close()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+External-memory sorting: items are sorted in chunks of bounded size, each
+chunk is written to a temporary file as a sorted run (pickled blocks), and the
+runs are k-way merged lazily (in several passes if there are too many runs to
+merge at once), so only about one chunk of items is ever held in memory.
+'''
+from heapq import merge
+from itertools import islice
+from pickle import HIGHEST_PROTOCOL,dump,load
+from tempfile import TemporaryFile
+MAX_FANOUT = 64 # maximum number of runs merged at once
+ITEM_BYTES = 128 # rough size of one small tuple of numbers in memory (used to turn a memory budget into a chunk size)
+
+# number of items per chunk that fits in a memory budget (in MB)
+def chunk_size_for_memory(memory_mb, item_bytes=ITEM_BYTES):
+    return max(1024, int(memory_mb*1048576)//item_bytes)
+
+# write sorted items to a temporary file in pickled blocks and return the file (deleted when closed)
+def write_run(items, block_size, directory=None):
+    f = TemporaryFile(dir=directory); items = iter(items)
+    for block in iter(lambda: list(islice(items,block_size)), []):
+        dump(block, f, protocol=HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+# yield the items of a run one block at a time, closing (deleting) it at the end
+def read_run(f):
+    try:
+        while True:
+            try:
+                block = load(f)
+            except EOFError:
+                break
+            for x in block:
+                yield x
+    finally:
+        f.close()
+
+# yield items in sorted order holding at most chunk_size of them in memory (plus one block per run while merging)
+def external_sort(items, chunk_size, directory=None, key=None, stats=None):
+    block_size = max(64, chunk_size//MAX_FANOUT); runs = list(); items = iter(items)
+    for chunk in iter(lambda: list(islice(items,chunk_size)), []):
+        chunk.sort(key=key)
+        if len(runs) == 0 and len(chunk) < chunk_size: # everything fit in memory
+            for x in chunk:
+                yield x
+            return
+        runs.append(write_run(chunk, block_size, directory)); chunk = None
+    if stats is not None:
+        stats['runs'] = stats.get('runs',0) + len(runs)
+    while len(runs) > MAX_FANOUT:
+        runs = [write_run(merge(*[read_run(f) for f in runs[i:i+MAX_FANOUT]], key=key), block_size, directory) for i in range(0,len(runs),MAX_FANOUT)]
+    for x in merge(*[read_run(f) for f in runs], key=key):
+        yield x
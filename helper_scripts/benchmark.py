@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+'''
+Benchmark ProACT's entry points on reproducible synthetic inputs. For every tree
+shape and size, a tree (virus|person|time leaf labels), a diagnosis TSV, and a
+FAVITES transmission network are generated from the seed, and each entry point
+is run in a fresh process (so memory numbers do not leak between runs). Wall
+time (best of the repeats) and peak memory are written as JSON.
+
+Shapes: balanced (perfectly balanced binary), ladder (caterpillar), polytomy
+(root -> internal nodes of large degree -> leaves), and tied (random binary
+shape where every edge has the same length, the worst case for ranking ties).
+'''
+from array import array
+from common import individual_efficacy,leaf_to_name,load_diagnosis,load_transmission_index,read_tree_compact
+from compact_tree import CompactTree
+from multiprocessing import get_context
+from multiprocessing.forkserver import ensure_running
+from os import makedirs
+from os.path import isfile,join
+from platform import platform,python_version
+from random import Random
+from resource import RUSAGE_SELF,getrusage
+from sys import platform as sys_platform,stderr
+from time import perf_counter
+from ProACT import prioritize,read_diagnosis
+import leaf_edgelength_over_time,leaf_stats,tree_time_window
+SHAPES = ['balanced', 'ladder', 'polytomy', 'tied']
+ENTRY_POINTS = ['parse', 'prioritize', 'prioritize_top', 'baseline_prioritize', 'leaf_stats', 'edgelength_over_time', 'individual_efficacy', 'extract_tree_with_taxa']
+MAX_TIME = 10.
+TOP_N = 500 # number of individuals ranked by prioritize_top
+
+# parent arrays (preorder) of each shape with n leaves
+def balanced_parents(n, rng):
+    parent = array('l'); stack = [(-1,n)]
+    while len(stack) != 0:
+        p,size = stack.pop(); u = len(parent); parent.append(p)
+        if size > 1:
+            stack.append((u,size-size//2)); stack.append((u,size//2))
+    return parent
+
+def ladder_parents(n, rng):
+    parent = array('l'); p = -1
+    for _ in range(n-1):
+        u = len(parent); parent.append(p); parent.append(u); p = u
+    parent.append(p)
+    return parent
+
+def polytomy_parents(n, rng, degree=1000):
+    parent = array('l', [-1])
+    if n <= degree:
+        return parent + array('l', [0])*n
+    for i in range(0,n,degree):
+        u = len(parent); parent.append(0); parent.extend(array('l', [u])*min(degree,n-i))
+    return parent
+
+def random_parents(n, rng):
+    parent = array('l'); stack = [(-1,n)]
+    while len(stack) != 0:
+        p,size = stack.pop(); u = len(parent); parent.append(p)
+        if size > 1:
+            k = rng.randint(1,size-1); stack.append((u,size-k)); stack.append((u,k))
+    return parent
+
+# synthetic CompactTree: leaf i is labeled V<i>|P<i>|<diagnosis time>, edge lengths are random (or all 1 for the tied shape)
+def generate_tree(shape, n, seed):
+    rng = Random(seed)
+    if shape == 'balanced':
+        parent = balanced_parents(n, rng)
+    elif shape == 'ladder':
+        parent = ladder_parents(n, rng)
+    elif shape == 'polytomy':
+        parent = polytomy_parents(n, rng)
+    elif shape == 'tied':
+        parent = random_parents(n, rng)
+    else:
+        raise ValueError("Invalid tree shape: %s" % shape)
+    is_leaf = array('b', [1])*len(parent)
+    for p in parent:
+        if p != -1:
+            is_leaf[p] = 0
+    label = array('l', [-1])*len(parent); labels = list(); times = array('d')
+    for u in range(len(parent)):
+        if is_leaf[u]:
+            i = len(labels); t = round(rng.uniform(MAX_TIME/2,MAX_TIME),4); label[u] = i; times.append(t); labels.append('V%d|P%d|%s' % (i,i,t))
+    if shape == 'tied':
+        edge_length = array('d', [1.])*len(parent)
+    else:
+        edge_length = array('d', (round(rng.expovariate(10),4) for _ in range(len(parent))))
+    edge_length[0] = float('nan')
+    return CompactTree(parent, edge_length, label, labels),times
+
+# FAVITES transmission network over individuals P0..P<n-1>: P0 is the seed, every other individual is infected (in order) by a random earlier
+# individual at a time before its diagnosis time
+def write_transmissions(n, times, seed, filename):
+    rng = Random(seed+1); f = open(filename,'w'); f.write('None\tP0\t0\n')
+    for i in range(1,n):
+        f.write('P%d\tP%d\t%s\n' % (rng.randrange(i), i, round(min(times[i],MAX_TIME/2)*i/n,4)))
+    f.close()
+
+# generate (or reuse) the tree, diagnosis, and transmission files of one shape and size
+def generate_inputs(shape, n, seed, directory):
+    prefix = join(directory, '%s_%d_%d' % (shape,n,seed)); files = {k:'%s.%s' % (prefix,k) for k in ('nwk','diag.tsv','trans.txt')}
+    if all(isfile(fn) for fn in files.values()):
+        return files
+    tree,times = generate_tree(shape, n, seed)
+    with open(files['nwk'],'w') as f:
+        f.write(tree.newick()); f.write('\n')
+    with open(files['diag.tsv'],'w') as f:
+        for l in tree.labels:
+            f.write('%s\t%s\n' % (l, l.split('|')[-1]))
+    write_transmissions(n, times, seed, files['trans.txt'])
+    return files
+
+# max resident set size of this process in MB (ru_maxrss is in KB on Linux, bytes on macOS)
+def max_rss_mb():
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    if sys_platform == 'darwin':
+        return rss/1048576
+    return rss/1024
+
+# setup (not timed) of one entry point: returns a function of no arguments that runs it
+def setup_entry_point(entry, files):
+    if entry == 'parse':
+        return lambda: read_tree_compact(files['nwk'])
+    if entry == 'baseline_prioritize': # the original comparator on a TreeSwift tree, for comparison
+        from check_ranking import baseline_prioritize; from treeswift import read_tree_newick
+        tree = read_tree_newick(files['nwk']); diag = read_diagnosis(files['diag.tsv'])
+        return lambda: baseline_prioritize(tree,'All',diag)
+    tree = read_tree_compact(files['nwk'])
+    if entry == 'prioritize':
+        diag = read_diagnosis(files['diag.tsv'])
+        return lambda: prioritize(tree,'All',diag)
+    if entry == 'prioritize_top':
+        diag = read_diagnosis(files['diag.tsv'])
+        return lambda: prioritize(tree,min(TOP_N,len(tree.labels)),diag)
+    if entry == 'leaf_stats':
+        return lambda: leaf_stats.compute_columns(tree)
+    if entry == 'edgelength_over_time':
+        leaf_edgelength_over_time.L2N = leaf_to_name(tree); diag = load_diagnosis(files['diag.tsv'])
+        return lambda: leaf_edgelength_over_time.edgelength_over_time(tree,diag)
+    if entry == 'individual_efficacy':
+        names = list(leaf_to_name(tree).values()); index = load_transmission_index(files['trans.txt'])
+        return lambda: individual_efficacy(names,index,0.,MAX_TIME/4)
+    if entry == 'extract_tree_with_taxa':
+        times = tree_time_window.leaf_times(tree); taxa = tree_time_window.window_taxa(times,MAX_TIME/2,0.75*MAX_TIME)
+        return lambda: tree_time_window.extract_tree_with_taxa(tree,taxa)
+    raise ValueError("Invalid entry point: %s" % entry)
+
+# child process: run one entry point `repeats` times, then report wall times and memory (optionally the tracemalloc peak of an extra traced run)
+def run_entry_point(entry, files, repeats, trace, conn):
+    try:
+        run = setup_entry_point(entry, files); setup_rss = max_rss_mb(); times = list()
+        for _ in range(repeats):
+            start = perf_counter(); run(); times.append(perf_counter()-start)
+        out = {'wall_time':min(times), 'wall_times':times, 'max_rss_mb':max_rss_mb(), 'rss_increase_mb':max_rss_mb()-setup_rss}
+        if trace:
+            import tracemalloc; tracemalloc.start(); run(); out['traced_peak_mb'] = tracemalloc.get_traced_memory()[1]/1048576; tracemalloc.stop()
+        conn.send(out)
+    except Exception as e:
+        conn.send({'error':'%s: %s' % (type(e).__name__,e)})
+
+# run every (shape, size, entry point) combination, each in a fresh process, yielding one result dict at a time
+def benchmark(shapes, sizes, entries, seed=0, repeats=3, directory='benchmark_data', trace=False):
+    makedirs(directory, exist_ok=True); ctx = get_context('forkserver'); ensure_running() # workers fork from a small server, not from this process
+    for shape in shapes:
+        for n in sizes:
+            files = generate_inputs(shape, n, seed, directory)
+            for entry in entries:
+                recv,send = ctx.Pipe(duplex=False); proc = ctx.Process(target=run_entry_point, args=(entry,files,repeats,trace,send)); proc.start(); send.close()
+                try:
+                    out = recv.recv()
+                except EOFError: # killed (e.g. out of memory) before reporting
+                    out = dict()
+                proc.join()
+                if len(out) == 0:
+                    out = {'error':'process exited with code %s' % proc.exitcode}
+                out.update({'shape':shape, 'num_leaves':n, 'entry_point':entry})
+                yield out
+
+# run main program
+if __name__ == "__main__":
+    import argparse; from json import dump
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', required=False, type=str, default='1000,10000,100000', help="Comma-separated Numbers of Leaves (e.g. 1e3,1e5,1e7)")
+    parser.add_argument('-t', '--shapes', required=False, type=str, default=','.join(SHAPES), help="Comma-separated Tree Shapes (%s)" % ', '.join(SHAPES))
+    parser.add_argument('-e', '--entry_points', required=False, type=str, default=','.join(ENTRY_POINTS), help="Comma-separated Entry Points (%s)" % ', '.join(ENTRY_POINTS))
+    parser.add_argument('-r', '--repeats', required=False, type=int, default=3, help="Timed Runs per Entry Point (best is reported)")
+    parser.add_argument('-S', '--seed', required=False, type=int, default=0, help="Random Number Seed")
+    parser.add_argument('-d', '--data', required=False, type=str, default='benchmark_data', help="Directory of Generated Inputs (reused across runs)")
+    parser.add_argument('-m', '--tracemalloc', action='store_true', help="Also Measure Peak Python Allocations (extra traced run)")
+    parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File (JSON)")
+    args = parser.parse_args()
+    sizes = [int(float(x)) for x in args.sizes.split(',')]; shapes = args.shapes.split(','); entries = args.entry_points.split(',')
+    for x in shapes:
+        assert x in SHAPES, "Invalid tree shape: %s" % x
+    for x in entries:
+        assert x in ENTRY_POINTS, "Invalid entry point: %s" % x
+    results = list()
+    for out in benchmark(shapes, sizes, entries, args.seed, args.repeats, args.data, args.tracemalloc):
+        results.append(out)
+        if 'error' in out:
+            stderr.write('%s\t%d\t%s\tERROR: %s\n' % (out['shape'],out['num_leaves'],out['entry_point'],out['error']))
+        else:
+            stderr.write('%s\t%d\t%s\t%.3fs\t%.1f MB\n' % (out['shape'],out['num_leaves'],out['entry_point'],out['wall_time'],out['max_rss_mb']))
+        stderr.flush()
+    report = {'python':python_version(), 'platform':platform(), 'seed':args.seed, 'repeats':args.repeats, 'results':results}
+    if args.output == 'stdout':
+        from sys import stdout; dump(report, stdout, indent=1); stdout.write('\n')
+    else:
+        with open(args.output,'w') as f:
+            dump(report, f, indent=1); f.write('\n')
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+'''
+Given a time series of clusterings in the Cluster Picker format (oldest first),
+compute cluster growth rates for every consecutive pair of snapshots and output
+the top n people of each later snapshot sorted by the growth rate of their
+cluster (break ties arbitrarily), in a single run. This fuses
+cluster_growth_rates.py and pick_by_cluster_growth.py: each clustering is read
+once, only the previous snapshot's cluster sizes are kept, and the top n are
+found by partial selection instead of a full sort.
+'''
+from array import array
+from cluster_growth_rates import growth
+from common import enable_profiling,load_clustering_columns,load_diagnosis_columns
+from heapq import nlargest
+from warnings import warn
+
+# (cluster names, individual names, cluster id of each individual, size of each cluster) of one snapshot
+def load_snapshot(filename):
+    ids,clusters,cluster = load_clustering_columns(filename); sizes = array('l', [0])*len(clusters)
+    for c in cluster:
+        sizes[c] += 1
+    return clusters.names,ids.names,cluster,sizes
+
+# yield (snapshot index, {cluster: growth rate}, [(growth rate, individual)] of the top n) for snapshots 1..K-1 (n = None for everybody)
+def growth_pipeline(filenames, n=None):
+    prev = None
+    for k,fn in enumerate(filenames):
+        names,people,cluster,sizes = load_snapshot(fn); sizes_by_name = dict(zip(names,sizes))
+        if prev is not None:
+            rate = [growth(prev.get(c,0),s) for c,s in zip(names,sizes)]; members = ((rate[c],u) for u,c in zip(people,cluster))
+            if n is None or n >= len(people):
+                top = sorted(members, reverse=True)
+            else:
+                top = nlargest(n, members)
+            yield k,dict(zip(names,rate)),top
+        prev = sizes_by_name
+
+# run main program
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--clusterings', required=True, type=str, nargs='+', help="Input Clustering Files (Cluster Picker format; oldest first)")
+    parser.add_argument('-d', '--diagnosis', required=False, type=str, default=None, help="Diagnosis File (fills the output when clusters have fewer than n people)")
+    parser.add_argument('-s', '--snapshot_times', required=False, type=float, nargs='+', default=None, help="Time of each Snapshot (only fill with people diagnosed by then)")
+    parser.add_argument('-n', '--number', required=False, type=str, default='All', help="Number of Individuals per Snapshot")
+    parser.add_argument('-g', '--growth_output', required=False, type=str, default=None, help="Output Growth Rate File (Snapshot, Cluster, GrowthRate)")
+    parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File (Snapshot, Rank, Individual, GrowthRate)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    args = parser.parse_args(); prof = enable_profiling(args.profile)
+    assert len(args.clusterings) >= 2, "Must specify at least two clusterings"
+    assert args.snapshot_times is None or len(args.snapshot_times) == len(args.clusterings), "Must specify one time per clustering"
+    assert args.snapshot_times is None or args.diagnosis is not None, "Snapshot times require a diagnosis file"
+    with prof.phase('load_diagnosis'):
+        if args.diagnosis is not None:
+            diag_ids,diag_times = load_diagnosis_columns(args.diagnosis,person=False)
+    if args.number == 'All':
+        number = None
+    else:
+        number = int(args.number); assert number > 0, "Number of individuals must be a positive integer"
+    if args.output == 'stdout':
+        from sys import stdout; output = stdout
+    else:
+        output = open(args.output,'w')
+    output.write('Snapshot\tRank\tIndividual\tGrowthRate\n')
+    if args.growth_output is not None:
+        growth_output = open(args.growth_output,'w'); growth_output.write('Snapshot\tCluster\tGrowthRate\n')
+    with prof.phase('pipeline'):
+        for k,rate,top in growth_pipeline(args.clusterings, number):
+            name = args.clusterings[k]
+            if args.growth_output is not None:
+                for c,g in rate.items():
+                    growth_output.write('%s\t%s\t%f\n' % (name,c,g))
+            for r,(g,u) in enumerate(top):
+                output.write('%s\t%d\t%s\t%f\n' % (name,r+1,u,g))
+            if number is not None and len(top) < number: # like pick_by_cluster_growth.py, fill from the diagnosed individuals
+                assert args.diagnosis is not None, "Number of output individuals (%d) is greater than the total number of individuals (%d) in %s, so must specify diagnosis file" % (number, len(top), name)
+                warn("Number of output individuals (%d) is greater than the total number of individuals (%d) in %s, so the remaining %d individuals will be randomly selected from the diagnosis file (%s)." % (number, len(top), name, number-len(top), args.diagnosis))
+            elif number is not None or args.diagnosis is None: # 'All' also outputs every diagnosed individual that is not clustered
+                continue
+            chosen = {u for g,u in top}; r = len(top)
+            if args.snapshot_times is None:
+                everybody = (u for u in diag_ids.names if u not in chosen)
+            else:
+                everybody = (u for u,t in zip(diag_ids.names,diag_times) if t <= args.snapshot_times[k] and u not in chosen)
+            for u in everybody:
+                if r == number:
+                    break
+                r += 1; output.write('%s\t%d\t%s\t\n' % (name,r,u))
+            assert number is None or r == number, "Not enough diagnosed individuals to output %d individuals in %s" % (number,name)
+    if args.growth_output is not None:
+        growth_output.close()
+    output.close()
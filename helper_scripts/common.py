@@ -2,82 +2,211 @@
 '''
 Common functions
 '''
+from array import array
+from bisect import bisect_left,bisect_right
 from gzip import open as gopen
-from sys import stdin
+from os.path import abspath,dirname
+from sys import path,stdin
+path.append(dirname(dirname(abspath(__file__)))) # repository root (compact_tree.py)
+from compact_tree import CompactTree,person_name,read_tree_compact
+from profiling import enable_profiling
+from tree_cache import TreeCache,load_table,load_tree
 
-def read_lines(filename):
+# stream the stripped non-empty lines of a (possibly gzipped) file or stdin, one buffered chunk at a time
+def iter_lines(filename):
     if filename == 'stdin':
-        return [l.strip() for l in stdin.read().strip().splitlines()]
+        f = stdin
     elif filename.lower().endswith('.gz'):
-        return [l.strip() for l in gopen(filename).read().decode().strip().splitlines()]
+        f = gopen(filename,'rt')
     else:
-        return [l.strip() for l in open(filename).read().strip().splitlines()]
+        f = open(filename)
+    while True:
+        lines = f.readlines(1048576)
+        if len(lines) == 0:
+            break
+        for l in lines:
+            l = l.strip()
+            if len(l) != 0:
+                yield l
+    if filename != 'stdin':
+        f.close()
+
+def read_lines(filename):
+    return list(iter_lines(filename))
+
+class IdTable:
+    '''Integer codes for strings (each distinct string is stored once)'''
+    def __init__(self):
+        self.names = list(); self.ids = dict()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return self.names[i]
+
+    def get_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names); self.names.append(name)
+        return self.ids[name]
+
+# diagnosis TSV as columns: (IdTable of individuals, array of diagnosis times indexed by id); later lines override earlier ones
+def load_diagnosis_columns(filename, person=True):
+    ids = IdTable(); times = array('d')
+    for l in iter_lines(filename):
+        try:
+            u,t = l.split(); t = float(t)
+        except:
+            raise RuntimeError("Invalid diagnosis time file (not TSV)")
+        if person:
+            u = person_name(u)
+        i = ids.get_id(u)
+        if i == len(times):
+            times.append(t)
+        else:
+            times[i] = t
+    return ids,times
+
+# (person names, diagnosis times) columns, as cached by load_diagnosis
+def diagnosis_table(filename):
+    ids,times = load_diagnosis_columns(filename)
+    return ids.names,times
+
+# {person name: diagnosis time}, parsed by load_diagnosis_columns with or without the cache
+def load_diagnosis(filename, cache=None):
+    names,times = load_table(filename, cache, diagnosis_table, 'diagnosis')
+    return dict(zip(names,times))
+
+def load_diag_times(filename, cache=None):
+    return load_diagnosis(filename, cache)
+
+# TreeCache of a cache directory (None if caching is disabled)
+def open_cache(directory, max_entries=16):
+    if directory is None:
+        return None
+    return TreeCache(directory, max_entries)
 
-def load_diag_times(filename):
-    diag = dict()
-    for l in read_lines(filename):
-        u,t = l.strip().split('\t')
-        if u.count('|') == 2: # virus|person|time identifiers
-            u = u.split('|')[1]
-        diag[u] = float(t)
-    return diag
+# (tree, {leaf: person name}) of a Newick file, reusing the parsed tree and normalized names from the cache if one is given
+def load_tree_names(filename, cache=None):
+    tree,names,entry = load_tree(filename, cache)
+    return tree,dict(zip(tree.traverse_leaves(),names))
+
+def parse_transmission(l):
+    try:
+        u,v,t = l.split(); t = float(t)
+    except:
+        raise RuntimeError("Invalid transmission network")
+    return u,v,t
 
 def load_transmissions(filename):
-    trans = []; nodes = set()
-    for l in read_lines(filename):
+    return [parse_transmission(l) for l in iter_lines(filename)]
+
+def load_transmission_index(filename):
+    index = TransmissionIndex()
+    for l in iter_lines(filename):
+        index.add(*parse_transmission(l))
+    index.finalize()
+    return index
+
+# Cluster Picker clustering as columns: (IdTable of individuals, IdTable of clusters, array of cluster ids indexed by individual id)
+def load_clustering_columns(filename):
+    ids = IdTable(); clusters = IdTable(); cluster = array('l')
+    for l in iter_lines(filename):
         try:
-            u,v,t = l.split(); t = float(t)
+            u,c = l.split()
         except:
-            raise RuntimeError("Invalid transmission network")
-        trans.append((u,v,t))
-    return trans
+            raise RuntimeError("Invalid clustering file (not Cluster Picker format)")
+        if u == 'SequenceName':
+            continue
+        i = ids.get_id(u); c = clusters.get_id(c)
+        if i == len(cluster):
+            cluster.append(c)
+        else:
+            cluster[i] = c
+    return ids,clusters,cluster
 
-def load_diagnosis(filename):
-    diag = dict()
-    for l in read_lines(filename):
+# {cluster: number of individuals} of a Cluster Picker clustering (individuals are not kept)
+def load_cluster_sizes(filename):
+    sizes = dict()
+    for l in iter_lines(filename):
         try:
-            u,t = l.split(); t = float(t)
+            u,c = l.split()
         except:
-            raise RuntimeError("Invalid diagnosis time file (not TSV)")
-        if u.count('|') == 2: # virus|person|time identifiers
-            u = u.split('|')[1]
-        diag[u] = t
-    return diag
+            raise RuntimeError("Invalid clustering file (not Cluster Picker format)")
+        if u != 'SequenceName':
+            sizes[c] = sizes.get(c,0) + 1
+    return sizes
 
 def individuals_from_lines(lines):
-    people = list()
-    for l in lines:
-        if l.count('|') == 2: # virus|person|time identifiers
-            people.append(l.split('|')[1])
-        else:
-            people.append(l)
-    return people
+    return [person_name(l) for l in lines]
+
+def leaf_labels(tree):
+    if isinstance(tree,CompactTree):
+        return [(l,tree.get_label(l)) for l in tree.traverse_leaves()]
+    return [(l,l.label) for l in tree.traverse_leaves()]
 
 def leaf_to_name(tree):
     tr = dict()
-    for l in tree.traverse_leaves():
-        if l.label.count('|') == 2: # virus|person|time identifiers
-            tr[l] = l.label.split('|')[1]
-        else:
-            tr[l] = l.label
+    for l,label in leaf_labels(tree):
+        tr[l] = person_name(label)
     return tr
 
 def load_individuals(filename):
-    return individuals_from_lines(read_lines(filename))
+    return individuals_from_lines(iter_lines(filename))
 
 def individuals_from_tree(tree):
-    return individuals_from_lines([l.label for l in tree.traverse_leaves()])
+    return individuals_from_lines([label for l,label in leaf_labels(tree)])
+
+class TransmissionIndex:
+    '''Sorted transmission times of each source plus the set of all individuals in the network, so "transmissions by u in [t1,t2]" is two bisects'''
+    def __init__(self, transmissions=()):
+        self.times = dict(); self.nodes = set()
+        for u,v,t in transmissions:
+            self.add(u,v,t)
+        self.finalize()
+
+    def add(self, u, v, t):
+        self.nodes.add(u); self.nodes.add(v)
+        if u not in self.times:
+            self.times[u] = array('d')
+        self.times[u].append(t)
+
+    # sort each source's times (call after the last add)
+    def finalize(self):
+        for u in self.times:
+            self.times[u] = array('d', sorted(self.times[u]))
+
+    # number of transmissions by u with from_time <= t <= to_time
+    def count(self, u, from_time, to_time):
+        if u not in self.times:
+            return 0
+        return bisect_right(self.times[u],to_time) - bisect_left(self.times[u],from_time)
+
+    def check_individuals(self, user_individuals):
+        for u in user_individuals:
+            assert u in self.nodes, "Individual not in transmission network: %s"%u
+
+    def efficacy(self, user_individuals, from_time, to_time):
+        assert to_time > from_time, "To Time must be larger than From Time"
+        self.check_individuals(user_individuals)
+        return {u:self.count(u,from_time,to_time) for u in user_individuals}
+
+    # efficacy of every individual in every (from_time,to_time) window at once: NumPy matrix (rows = individuals, columns = windows)
+    def efficacy_windows(self, user_individuals, windows):
+        from numpy import array as nparray,frombuffer,searchsorted,zeros
+        starts = nparray([w[0] for w in windows], dtype=float); ends = nparray([w[1] for w in windows], dtype=float)
+        assert (ends > starts).all(), "To Time must be larger than From Time"
+        self.check_individuals(user_individuals); eff = zeros((len(user_individuals),len(windows)), dtype=int)
+        for i,u in enumerate(user_individuals):
+            if u in self.times:
+                times = frombuffer(self.times[u], dtype=float)
+                eff[i] = searchsorted(times,ends,side='right') - searchsorted(times,starts,side='left')
+        return eff
 
 def individual_efficacy(user_individuals,transmissions,from_time,to_time):
-    assert to_time > from_time, "To Time must be larger than From Time"
-    eff = {u:0 for u in user_individuals}; trans_nodes = set()
-    for u,v,t in transmissions:
-        trans_nodes.add(u); trans_nodes.add(v)
-        if t >= from_time and t <= to_time and u in eff:
-            eff[u] += 1
-    for u in eff:
-        assert u in trans_nodes, "Individual not in transmission network: %s"%u
-    return eff
+    if not isinstance(transmissions,TransmissionIndex):
+        transmissions = TransmissionIndex(transmissions)
+    return transmissions.efficacy(user_individuals,from_time,to_time)
 
 def optimal_order(individuals,eff):
     return sorted(individuals, key=lambda x: eff[x], reverse=True)
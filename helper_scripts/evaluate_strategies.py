@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+Compare prioritization strategies (e.g. ProACT, growth-based, optimal, random)
+across simulation replicates by their cumulative efficacy curves: for every
+n, the average number of individuals infected between from_time and to_time by
+the first n individuals of each ranked list. Each replicate's transmission
+network is read once into per-person transmission counts, every curve is a
+prefix sum over those counts, and replicates run in parallel worker processes.
+
+The manifest is a TSV with one (Replicate, Transmissions, Strategy, Ranking)
+row per ranked list (Ranking = file with one individual per line, e.g. the
+output of ProACT.py). The "optimal" (sorted by true efficacy) and "random"
+strategies can be added to every replicate automatically, using the
+individuals of that replicate's ranked lists.
+'''
+from common import iter_lines,load_individuals,load_transmission_index,optimal_order
+from multiprocessing import Pool
+from random import Random
+
+# manifest rows grouped by replicate: {replicate: (transmissions file, {strategy: ranking file})} in file order
+def load_manifest(filename):
+    replicates = dict()
+    for l in iter_lines(filename):
+        parts = l.split('\t')
+        if parts[0] == 'Replicate':
+            continue
+        try:
+            rep,trans,strategy,ranking = parts
+        except ValueError:
+            raise RuntimeError("Invalid manifest (expected Replicate, Transmissions, Strategy, Ranking)")
+        if rep not in replicates:
+            replicates[rep] = (trans, dict())
+        assert replicates[rep][0] == trans, "Replicate %s has more than one transmission network" % rep
+        replicates[rep][1][strategy] = ranking
+    return replicates
+
+# cumulative efficacy curve of a ranked list: curve[n-1] = (transmissions by the first n individuals)/n
+def efficacy_curve(order, eff):
+    from numpy import arange,cumsum,fromiter
+    counts = fromiter((eff[u] for u in order), dtype=float, count=len(order))
+    return cumsum(counts)/arange(1,len(order)+1)
+
+# pool worker: {strategy: efficacy curve} of one replicate
+def evaluate_replicate(job):
+    rep,trans,rankings,from_time,to_time,add_optimal,num_random,seed = job
+    index = load_transmission_index(trans); orders = {s:load_individuals(fn) for s,fn in rankings.items()}; population = list()
+    seen = set()
+    for order in orders.values():
+        for u in order:
+            if u not in seen:
+                seen.add(u); population.append(u)
+    eff = index.efficacy(population, from_time, to_time)
+    if add_optimal:
+        orders['optimal'] = optimal_order(population, eff)
+    curves = {s:efficacy_curve(order, eff) for s,order in orders.items()}
+    if num_random != 0: # average of num_random shuffles
+        rng = Random('%s-%s' % (seed,rep)); total = None
+        for _ in range(num_random):
+            order = list(population); rng.shuffle(order); c = efficacy_curve(order, eff); total = c if total is None else total + c
+        curves['random'] = total/num_random
+    return rep,curves
+
+# {strategy: matrix of curves (rows = replicates, NaN-padded to the longest list)} over all replicates, computed in a process pool
+def evaluate(replicates, from_time, to_time, add_optimal=True, num_random=0, seed=0, processes=None):
+    from numpy import full,nan
+    jobs = [(rep,trans,rankings,from_time,to_time,add_optimal,num_random,seed) for rep,(trans,rankings) in replicates.items()]
+    if processes == 1:
+        results = list(map(evaluate_replicate, jobs))
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(evaluate_replicate, jobs)
+    strategies = list(); length = dict()
+    for rep,curves in results:
+        for s,c in curves.items():
+            if s not in length:
+                strategies.append(s); length[s] = 0
+            length[s] = max(length[s], len(c))
+    out = {s:full((len(results),length[s]), nan) for s in strategies}
+    for i,(rep,curves) in enumerate(results):
+        for s,c in curves.items():
+            out[s][i,:len(c)] = c
+    return [rep for rep,curves in results],out
+
+# summary rows (strategy, n, mean efficacy, standard deviation, number of replicates) at the given cutoffs (all n by default)
+def summarize(curves, cutoffs=None):
+    from numpy import isnan,nanmean,nanstd
+    for s,m in curves.items():
+        ns = range(1,m.shape[1]+1) if cutoffs is None else [n for n in cutoffs if n <= m.shape[1]]
+        cols = [n-1 for n in ns]; sub = m[:,cols]; num = (~isnan(sub)).sum(axis=0); mean = nanmean(sub, axis=0); std = nanstd(sub, axis=0)
+        for j,n in enumerate(ns):
+            yield s,n,mean[j],std[j],num[j]
+
+# run main program
+if __name__ == "__main__":
+    import argparse; from common import enable_profiling
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-m', '--manifest', required=True, type=str, help="Manifest File (TSV: Replicate, Transmissions, Strategy, Ranking)")
+    parser.add_argument('-t', '--from_time', required=True, type=float, help="From Time (for # transmissions)")
+    parser.add_argument('-tt', '--to_time', required=False, type=float, default=float('inf'), help="To Time (for # transmissions)")
+    parser.add_argument('-n', '--cutoffs', required=False, type=str, default=None, help="Comma-separated Numbers of Individuals to Report (default: every n)")
+    parser.add_argument('-no', '--no_optimal', action='store_true', help="Do not Add the Optimal Strategy")
+    parser.add_argument('-r', '--random', required=False, type=int, default=0, help="Number of Random Orders Averaged into the Random Strategy (0 = none)")
+    parser.add_argument('-s', '--seed', required=False, type=int, default=0, help="Random Number Seed")
+    parser.add_argument('-p', '--processes', required=False, type=int, default=None, help="Number of Worker Processes")
+    parser.add_argument('-c', '--curves', required=False, type=str, default=None, help="Output Per-Replicate Curves File (TSV: Replicate, Strategy, N, Efficacy)")
+    parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output Summary File (TSV)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    args = parser.parse_args(); prof = enable_profiling(args.profile)
+    cutoffs = None if args.cutoffs is None else sorted({int(x) for x in args.cutoffs.split(',')})
+    with prof.phase('load_manifest'):
+        replicates = load_manifest(args.manifest)
+    with prof.phase('evaluate'):
+        reps,curves = evaluate(replicates, args.from_time, args.to_time, not args.no_optimal, args.random, args.seed, args.processes)
+    with prof.phase('write_output'):
+        if args.output == 'stdout':
+            from sys import stdout; output = stdout
+        else:
+            output = open(args.output,'w')
+        output.write('Strategy\tN\tMeanEfficacy\tStdEfficacy\tNumReplicates\n')
+        for s,n,mean,std,num in summarize(curves, cutoffs):
+            output.write('%s\t%d\t%f\t%f\t%d\n' % (s,n,mean,std,num))
+        output.close()
+        if args.curves is not None:
+            f = open(args.curves,'w'); f.write('Replicate\tStrategy\tN\tEfficacy\n')
+            for s,m in curves.items():
+                for i,rep in enumerate(reps):
+                    for n in (range(1,m.shape[1]+1) if cutoffs is None else cutoffs):
+                        if n <= m.shape[1] and m[i,n-1] == m[i,n-1]: # skip NaN padding
+                            f.write('%s\t%s\t%d\t%f\n' % (rep,s,n,m[i,n-1]))
+            f.close()
@@ -3,18 +3,33 @@
 Compute clustering efficacy (average number of individuals infected by
 user-selected individuals between from_time and to_time).
 '''
-from common import individual_efficacy,load_individuals,load_transmissions
+from common import enable_profiling,individual_efficacy,load_individuals,load_transmission_index
 import argparse
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-i', '--individuals', required=False, type=str, default='stdin', help="Individuals (one per line)")
     parser.add_argument('-tn', '--transmissions', required=True, type=str, help="Transmission Network (FAVITES format)")
-    parser.add_argument('-t', '--from_time', required=True, type=float, help="From Time")
+    parser.add_argument('-t', '--from_time', required=False, type=float, default=None, help="From Time")
     parser.add_argument('-tt', '--to_time', required=False, type=float, default=float('inf'), help="To Time")
-    args = parser.parse_args()
-    trans = load_transmissions(args.transmissions)
-    user_individuals = load_individuals(args.individuals)
-    eff = individual_efficacy(user_individuals,trans,args.from_time,args.to_time)
-    for u in user_individuals:
-        print('%s\t%d'%(u,eff[u]))
+    parser.add_argument('-w', '--windows', required=False, type=str, default=None, help="Window File (one 'from_time to_time' pair per line; one output column per window)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    args = parser.parse_args(); prof = enable_profiling(args.profile)
+    assert (args.from_time is None) != (args.windows is None), "Must specify exactly one of From Time or Window File"
+    with prof.phase('load_transmissions'):
+        trans = load_transmission_index(args.transmissions)
+    with prof.phase('load_individuals'):
+        user_individuals = load_individuals(args.individuals)
+    if args.windows is None:
+        with prof.phase('efficacy'):
+            eff = individual_efficacy(user_individuals,trans,args.from_time,args.to_time)
+        with prof.phase('write_output'):
+            for u in user_individuals:
+                print('%s\t%d'%(u,eff[u]))
+    else:
+        windows = [tuple(float(x) for x in l.split()) for l in open(args.windows).read().strip().splitlines()]
+        with prof.phase('efficacy'):
+            eff = trans.efficacy_windows(user_individuals,windows)
+        with prof.phase('write_output'):
+            for u,row in zip(user_individuals,eff):
+                print('%s\t%s'%(u,'\t'.join(str(x) for x in row)))
@@ -1,90 +1,144 @@
 #!/usr/bin/env python3
-from common import individual_efficacy,leaf_to_name,load_diagnosis,load_transmissions
-from matplotlib.cm import Reds,ScalarMappable
-from matplotlib.colors import Normalize
-from matplotlib.patches import Patch
-from treeswift import read_tree_newick
+from array import array
+from common import enable_profiling,individual_efficacy,load_diagnosis,load_transmission_index,load_tree_names,open_cache
+from math import isnan
 import argparse
-import matplotlib.pyplot as plt
 
+# edge lengths with missing values replaced by 0 (the root's edge is kept)
+def edge_lengths(tree):
+    return array('d', (0. if isnan(x) else x for x in tree.edge_length))
+
+# latest leaf time among the siblings' subtrees of each node (None for the root), using the parent's two largest child values
 def compute_max_sibling_leaf_time(tree,inf):
-    max_inf = dict()
+    max_inf = array('d', [float('-inf')])*len(tree); max1_child = array('l', [-1])*len(tree); max2 = array('d', [float('-inf')])*len(tree)
     for u in tree.traverse_postorder():
-        if u.is_leaf():
+        if tree.is_leaf(u):
             max_inf[u] = inf[L2N[u]]
+        if u != 0:
+            p = tree.parent[u]
+            if max_inf[u] > max_inf[p]:
+                max2[p] = max_inf[p]; max_inf[p] = max_inf[u]; max1_child[p] = u
+            elif max_inf[u] > max2[p]:
+                max2[p] = max_inf[u]
+    out = [None]*len(tree)
+    for u in range(1,len(tree)):
+        p = tree.parent[u]
+        if max1_child[p] == u:
+            out[u] = max2[p]
         else:
-            max_inf[u] = max(max_inf[c] for c in u.children)
-    out = dict()
-    for u in tree.traverse_postorder():
-        if u.is_root():
-            out[u] = None
-        else:
-            out[u] = max(max_inf[c] for c in u.parent.children if c != u)
+            out[u] = max_inf[p]
     return out
 
 def edgelength_over_time(tree,inf): # each element in list for a given leaf is (time,length) tuple
-    el_t = dict(); max_sib_inf = compute_max_sibling_leaf_time(tree,diag); oldest_leaf = dict()
-    # compute (oldest_time,leaf) tuples for each node
+    el_t = dict(); max_sib_inf = compute_max_sibling_leaf_time(tree,inf); el = edge_lengths(tree)
+    # compute (oldest_time,label,leaf) tuples for each node, plus the second oldest among each node's children (for sibling exclusion)
+    oldest_leaf = [None]*len(tree); oldest_child = array('l', [-1])*len(tree); second_oldest = [None]*len(tree)
     for u in tree.traverse_postorder():
-        if u.is_leaf():
-            oldest_leaf[u] = (inf[L2N[u]],u)
-        else:
-            oldest_leaf[u] = min(oldest_leaf[c] for c in u.children)
+        if tree.is_leaf(u):
+            oldest_leaf[u] = (inf[L2N[u]],tree.get_label(u),u)
+        if u != 0:
+            p = tree.parent[u]
+            if oldest_leaf[p] is None or oldest_leaf[u] < oldest_leaf[p]:
+                second_oldest[p] = oldest_leaf[p]; oldest_leaf[p] = oldest_leaf[u]; oldest_child[p] = u
+            elif second_oldest[p] is None or oldest_leaf[u] < second_oldest[p]:
+                second_oldest[p] = oldest_leaf[u]
     # compute edge length over time
     for u in tree.traverse_postorder():
-        if u.is_leaf():
+        if tree.is_leaf(u):
             if inf[L2N[u]] >= max_sib_inf[u]:
-                el_t[u] = [[inf[L2N[u]],u.edge_length]]
+                el_t[u] = [[inf[L2N[u]],el[u]]]
             else:
-                el_t[u] = [[max_sib_inf[u],u.edge_length]]
+                el_t[u] = [[max_sib_inf[u],el[u]]]
         else:
-            if u.edge_length is None:
-                el = 0
-            else:
-                el = u.edge_length
-            if u.is_root():
+            l = oldest_leaf[u][2]
+            if u == 0:
                 prev_time = oldest_leaf[u][0]
             else:
-                prev_time = min(oldest_leaf[c] for c in u.parent.children if oldest_leaf[c][1] != oldest_leaf[u][1])[0]
-            if prev_time >= oldest_leaf[u][0] and prev_time < el_t[oldest_leaf[u][1]][-1][0]:
-                el_t[oldest_leaf[u][1]].append([prev_time,el_t[oldest_leaf[u][1]][-1][1]])
-            el_t[oldest_leaf[u][1]][-1][1] += el
+                p = tree.parent[u]
+                if oldest_child[p] == u:
+                    sib = second_oldest[p]
+                else:
+                    sib = oldest_leaf[p]
+                if sib is None:
+                    prev_time = float('inf')
+                else:
+                    prev_time = sib[0]
+            if prev_time >= oldest_leaf[u][0] and prev_time < el_t[l][-1][0]:
+                el_t[l].append([prev_time,el_t[l][-1][1]])
+            el_t[l][-1][1] += el[u]
     for l in el_t:
         if el_t[l][-1][0] > inf[L2N[l]]:
             el_t[l][-1][0] = inf[L2N[l]]
     return {l:el_t[l][::-1] for l in el_t}
 
-def plot_edgelength_over_time(el_t,eff,max_num_lines):
+# write every leaf's step function as rows of (name, time, edge length)
+def write_edgelength_table(el_t,filename):
+    f = open(filename,'w'); f.write('Individual\tTime\tEdgeLength\n')
+    for l in el_t:
+        for t,length in el_t[l]:
+            f.write('%s\t%s\t%s\n' % (L2N[l],t,length))
+    f.close()
+
+# draw all step functions as a single line collection, then show the figure (or save it headless if an output file is given)
+def plot_edgelength_over_time(el_t,eff,max_num_lines,output=None):
+    if output is not None:
+        import matplotlib; matplotlib.use('Agg')
+    from matplotlib.cm import Reds,ScalarMappable
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import Normalize
+    from matplotlib.patches import Patch
+    import matplotlib.pyplot as plt
     leaves = sorted(el_t.keys(), key=lambda a: eff[L2N[a]])
     if max_num_lines is not None:
         leaves = leaves[-max_num_lines:]
     min_eff = min(eff[L2N[l]] for l in leaves); max_eff = max(eff[L2N[l]] for l in leaves); max_time = max(el_t[l][-1][0] for l in leaves)
     norm = Normalize(vmin=min_eff, vmax=max_eff, clip=True); color_mapper = ScalarMappable(norm=norm, cmap=Reds)
     handles = [Patch(color=color_mapper.to_rgba(e), label='%d Transmission(s)'%e) for e in (min_eff,max_eff)]
+    segments = list()
     for l in leaves:
         pairs = el_t[l]
-        x = [pairs[0][0]]; y = [pairs[0][1]] # start (just a point)
+        line = [(pairs[0][0],pairs[0][1])] # start (just a point)
         for t,el in pairs[1:]:
-            x.append(t); y.append(y[-1]) # bring it forward
-            x.append(t); y.append(el) # bring it up
-        x.append(max_time); y.append(y[-1])
-        plt.plot(x, y, color=color_mapper.to_rgba(eff[L2N[l]]))
+            line.append((t,line[-1][1])) # bring it forward
+            line.append((t,el)) # bring it up
+        line.append((max_time,line[-1][1]))
+        segments.append(line)
+    ax = plt.gca(); ax.add_collection(LineCollection(segments, colors=color_mapper.to_rgba([eff[L2N[l]] for l in leaves]))); ax.autoscale()
     plt.legend(handles=handles, bbox_to_anchor=(0.995, 0.995), loc=1, borderaxespad=0.)
     plt.xlabel('Time'); plt.ylabel('Edge Length'); plt.title('Edge Length vs. Time')
-    plt.tight_layout(); plt.show()
+    plt.tight_layout()
+    if output is None:
+        plt.show()
+    else:
+        plt.savefig(output); plt.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-tr', '--tree', required=True, type=str, help="Phylogenetic Tree (Newick format)")
     parser.add_argument('-d', '--diagnosis', required=True, type=str, help="Diagnosis Times (TSV)")
-    parser.add_argument('-tn', '--transmissions', required=True, type=str, help="Transmission Network (FAVITES format)")
-    parser.add_argument('-t', '--from_time', required=True, type=float, help="From Time (for # transmissions)")
+    parser.add_argument('-tn', '--transmissions', required=False, type=str, default=None, help="Transmission Network (FAVITES format; required unless exporting)")
+    parser.add_argument('-t', '--from_time', required=False, type=float, default=None, help="From Time (for # transmissions; required unless exporting)")
     parser.add_argument('-tt', '--to_time', required=False, type=float, default=float('inf'), help="To Time (for # transmissions)")
-    parser.add_argument('-n', '--max_num_lines', required=False, type=int, default=None, help="Maximum Number of Lines to Draw (reduce this for speed)")
+    parser.add_argument('-n', '--max_num_lines', required=False, type=int, default=None, help="Maximum Number of Lines to Draw")
+    parser.add_argument('-o', '--output', required=False, type=str, default=None, help="Output Figure File (e.g. PNG/SVG/PDF; default: show interactively)")
+    parser.add_argument('-e', '--export', required=False, type=str, default=None, help="Output Step Function Table (TSV; skips plotting)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (reuse parsed tree and diagnosis times across runs)")
     args = parser.parse_args()
-    tree = read_tree_newick(args.tree)
-    diag = load_diagnosis(args.diagnosis)
-    global L2N; L2N = leaf_to_name(tree)
-    eff = individual_efficacy([L2N[l] for l in tree.traverse_leaves()],load_transmissions(args.transmissions),args.from_time,args.to_time)
-    el_t = edgelength_over_time(tree,diag)
-    plot_edgelength_over_time(el_t,eff,args.max_num_lines)
+    assert args.export is not None or args.transmissions is not None, "Plotting requires a transmission network (-tn)"
+    assert args.export is not None or args.from_time is not None, "Plotting requires a from time (-t)"
+    prof = enable_profiling(args.profile); cache = open_cache(args.cache)
+    with prof.phase('parse_tree'):
+        global L2N; tree,L2N = load_tree_names(args.tree,cache)
+    with prof.phase('diagnosis'):
+        diag = load_diagnosis(args.diagnosis,cache)
+    with prof.phase('edgelength_over_time'):
+        el_t = edgelength_over_time(tree,diag)
+    if args.export is not None:
+        with prof.phase('write_output'):
+            write_edgelength_table(el_t,args.export)
+    else:
+        with prof.phase('efficacy'):
+            eff = individual_efficacy([L2N[l] for l in tree.traverse_leaves()],load_transmission_index(args.transmissions),args.from_time,args.to_time)
+        with prof.phase('plot'):
+            plot_edgelength_over_time(el_t,eff,args.max_num_lines,args.output)
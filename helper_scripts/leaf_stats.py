@@ -1,56 +1,64 @@
 #!/usr/bin/env python3
-from common import individual_efficacy,leaf_to_name,load_diag_times,load_transmissions
-from treeswift import read_tree_newick
+from array import array
+from common import enable_profiling,individual_efficacy,load_diag_times,load_transmission_index,load_tree_names,open_cache
 import argparse
 ORDER = ['name', 'diagnosis', 'efficacy', 'edge_length', 'root_to_tip', 'root_to_tip_u', 'sib_leaves', 'closest_leaf']
+FORMATS = ['csv', 'npz', 'parquet']
 
-def compute_sib_leaves(tree):
-    num_leaves = dict()
+# every tree feature column (aligned with tree.traverse_leaves()) in one postorder and one preorder pass. Sibling exclusions use the parent's
+# total (sib_leaves) and its two smallest child values (closest_leaf), so a node with d children costs O(d) instead of O(d^2)
+def compute_columns(tree):
+    inf = float('inf'); el = tree.edge_lengths_or_zero(); par = tree.parent
+    num_leaves = array('l', [0])*len(tree); closest_below = array('d', [inf])*len(tree)
+    min1 = array('d', [inf])*len(tree); min1_child = array('l', [-1])*len(tree); min2 = array('d', [inf])*len(tree)
     for u in tree.traverse_postorder():
-        if u.is_leaf():
-            num_leaves[u] = 1
-        else:
-            num_leaves[u] = sum(num_leaves[c] for c in u.children)
-    return {L2N[l]:sum(num_leaves[c] for c in l.parent.children if c != l) for l in L2N}
-
-def compute_root_to_tip(tree, weighted=True):
-    root_to_tip = dict()
+        if tree.is_leaf(u):
+            num_leaves[u] = 1; closest_below[u] = 0
+        if u != 0:
+            p = par[u]; x = closest_below[u]; num_leaves[p] += num_leaves[u]
+            if x+el[u] < closest_below[p]:
+                closest_below[p] = x+el[u]
+            if x < min1[p]:
+                min2[p] = min1[p]; min1[p] = x; min1_child[p] = u
+            elif x < min2[p]:
+                min2[p] = x
+    root_to_tip = array('d', [0.])*len(tree); root_to_tip_u = array('l', [0])*len(tree); closest_above = array('d', [inf])*len(tree)
     for u in tree.traverse_preorder():
-        if u.is_root():
-            root_to_tip[u] = 0
-        elif not weighted:
-            root_to_tip[u] = root_to_tip[u.parent] + 1
-        elif u.edge_length is None:
-            root_to_tip[u] = root_to_tip[u.parent]
-        else:
-            root_to_tip[u] = root_to_tip[u.parent] + u.edge_length
-    return {L2N[l]:root_to_tip[l] for l in L2N}
+        if u != 0:
+            p = par[u]; root_to_tip[u] = root_to_tip[p] + el[u]; root_to_tip_u[u] = root_to_tip_u[p] + 1
+            if min1_child[p] == u:
+                sib = min2[p]
+            else:
+                sib = min1[p]
+            closest_above[u] = min(closest_above[p], sib) + el[u]
+    leaves = tree.traverse_leaves(); cols = dict()
+    cols['edge_length'] = [tree.get_edge_length(l) for l in leaves]
+    cols['root_to_tip'] = [root_to_tip[l] for l in leaves]
+    cols['root_to_tip_u'] = [root_to_tip_u[l] for l in leaves]
+    cols['sib_leaves'] = [num_leaves[par[l]]-num_leaves[l] for l in leaves]
+    cols['closest_leaf'] = [closest_above[l] for l in leaves]
+    return cols
 
-def compute_closest_leaf(tree):
-    closest_below = dict()
-    for u in tree.traverse_postorder():
-        if u.is_leaf():
-            closest_below[u] = 0
+# write columns as CSV, NumPy .npz (one array per column), or Parquet (requires pyarrow)
+def write_columns(cols, order, output, fmt='csv'):
+    if fmt == 'csv':
+        if output == 'stdout':
+            from sys import stdout; f = stdout
         else:
-            closest_below[u] = min(closest_below[c]+c.edge_length for c in u.children)
-    closest_above = dict()
-    for u in tree.traverse_preorder():
-        if u.is_root():
-            closest_above[u] = float('inf')
-        else:
-            closest_above[u] = min(closest_above[u.parent], min(closest_below[c] for c in u.parent.children if c != u))
-            if u.edge_length is not None:
-                closest_above[u] += u.edge_length
-    return {L2N[l]:closest_above[l] for l in L2N}
-
-def compute_vals(tree):
-    vals = dict()
-    vals['sib_leaves'] = compute_sib_leaves(tree)
-    vals['edge_length'] = {L2N[l]:l.edge_length for l in L2N}
-    vals['root_to_tip'] = compute_root_to_tip(tree, weighted=True)
-    vals['root_to_tip_u'] = compute_root_to_tip(tree, weighted=False)
-    vals['closest_leaf'] = compute_closest_leaf(tree)
-    return vals
+            f = open(output,'w')
+        f.write(','.join(order)); f.write('\n')
+        for row in zip(*[cols[k] for k in order]):
+            f.write(','.join(str(x) for x in row)); f.write('\n')
+        if output != 'stdout':
+            f.close()
+    elif fmt == 'npz':
+        from numpy import array as nparray,nan,savez
+        savez(output, **{k:nparray([nan if x is None else x for x in cols[k]]) for k in order})
+    elif fmt == 'parquet':
+        from pyarrow import table; from pyarrow.parquet import write_table
+        write_table(table({k:cols[k] for k in order}), output)
+    else:
+        raise ValueError("Invalid output format: %s" % fmt)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -59,13 +67,22 @@ if __name__ == "__main__":
     parser.add_argument('-tn', '--transmissions', required=True, type=str, help="Transmission Network (FAVITES format)")
     parser.add_argument('-t', '--from_time', required=True, type=float, help="From Time (for # transmissions)")
     parser.add_argument('-tt', '--to_time', required=False, type=float, default=float('inf'), help="To Time (for # transmissions)")
+    parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File")
+    parser.add_argument('-f', '--format', required=False, type=str, default='csv', choices=FORMATS, help="Output Format")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (reuse parsed tree and diagnosis times across runs)")
     args = parser.parse_args()
-    tree = read_tree_newick(args.tree)
-    global L2N; L2N = leaf_to_name(tree)
-    vals = compute_vals(tree)
-    vals['name'] = {L2N[l]:L2N[l] for l in L2N}
-    vals['efficacy'] = individual_efficacy([L2N[l] for l in tree.traverse_leaves()],load_transmissions(args.transmissions),args.from_time,args.to_time)
-    vals['diagnosis'] = load_diag_times(args.diagnosis)
-    print(','.join(ORDER))
-    for l in L2N:
-        print(','.join(str(vals[k][L2N[l]]) for k in ORDER))
+    assert args.format == 'csv' or args.output != 'stdout', "Binary output formats require an output file"
+    prof = enable_profiling(args.profile); cache = open_cache(args.cache)
+    with prof.phase('parse_tree'):
+        tree,L2N = load_tree_names(args.tree,cache); names = [L2N[l] for l in tree.traverse_leaves()]
+    with prof.phase('compute_columns'):
+        cols = compute_columns(tree); cols['name'] = names
+    with prof.phase('load_transmissions'):
+        trans = load_transmission_index(args.transmissions)
+    with prof.phase('efficacy'):
+        eff = individual_efficacy(names,trans,args.from_time,args.to_time); cols['efficacy'] = [eff[u] for u in names]
+    with prof.phase('diagnosis'):
+        diag = load_diag_times(args.diagnosis,cache); cols['diagnosis'] = [diag[u] for u in names]
+    with prof.phase('write_output'):
+        write_columns(cols, ORDER, args.output, args.format)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''
+Cluster the leaves of a tree T without an external tool: a cluster is a maximal
+clade whose leaves are all within a threshold distance of each other
+(max_clade) or whose edges are all at most a threshold length (length_clade),
+and clades with fewer than a minimum number of leaves are left unclustered.
+Output is in the Cluster Picker format (SequenceName, ClusterNumber; unclustered
+leaves are omitted), so it can be fed to cluster_growth_rates.py,
+pick_by_cluster_growth.py, or cluster_growth_pipeline.py.
+
+Many thresholds and time windows (leaves restricted to a window as in
+tree_time_window.py) are clustered from a single parse of T, with one linear
+pass per window and one per threshold. Clusters are numbered by the preorder
+index of their MRCA in T, so a clade keeps its number across thresholds and
+windows.
+'''
+from array import array
+from common import enable_profiling,load_tree_names,open_cache,read_tree_compact
+from multiprocessing import Pool
+from tree_time_window import leaf_times,window_list,window_taxa
+METHODS = ['max_clade', 'length_clade']
+
+# one postorder pass over the subtree induced by the kept leaves (all leaves if keep is None; unifurcations are folded into their child edge):
+# count[u] = number of kept leaves below u, mrca[u] = their MRCA, stat[u] = max pairwise leaf distance (max_clade) or max edge length
+# (length_clade) of that induced clade
+def clade_stats(tree, keep=None, method='max_clade'):
+    assert method in METHODS, "Invalid clustering method: %s" % method
+    N = len(tree); par = tree.parent; el = tree.edge_lengths_or_zero(); max_clade = method == 'max_clade'
+    count = array('l', [0])*N; mrca = array('l', [-1])*N; stat = array('d', [0])*N
+    h = array('d', [0])*N # max_clade: max distance from u down to a kept leaf; length_clade: length of the unifurcation chain from mrca[u] up to u
+    for u in tree.traverse_postorder():
+        if tree.is_leaf(u) and (keep is None or keep[u]):
+            count[u] = 1; mrca[u] = u
+        if count[u] == 0 or u == 0:
+            continue
+        p = par[u]; d = h[u] + el[u]
+        if count[p] == 0: # first kept child
+            h[p] = d; stat[p] = stat[u]; mrca[p] = mrca[u]
+        elif max_clade:
+            stat[p] = max(stat[p], stat[u], h[p]+d); h[p] = max(h[p], d); mrca[p] = p
+        else: # the chains of all kept children become edges of the induced clade
+            stat[p] = max(stat[p], stat[u], h[p], d); h[p] = 0; mrca[p] = p
+        count[p] += count[u]
+    return count,mrca,stat
+
+# (leaves, cluster numbers) of the maximal clades with stat <= threshold and at least min_size kept leaves
+def threshold_clusters(tree, count, mrca, stat, threshold, min_size=2):
+    par = tree.parent; cluster = array('l', [-1])*len(tree); leaves = array('l'); numbers = array('l')
+    for u in tree.traverse_preorder():
+        if count[u] == 0:
+            continue
+        c = -1 if u == 0 else cluster[par[u]]
+        if c == -1 and stat[u] <= threshold and count[u] >= min_size:
+            c = mrca[u]
+        cluster[u] = c
+        if c != -1 and tree.is_leaf(u):
+            leaves.append(u); numbers.append(c)
+    return leaves,numbers
+
+# pool worker: the parsed tree, leaf times, and settings are sent once per worker process
+def init_cluster_worker(tree, times, thresholds, method, min_size):
+    global TREE,TIMES,SETTINGS; TREE = tree; TIMES = times; SETTINGS = (thresholds,method,min_size)
+
+# [(leaves, cluster numbers) of each threshold] in one window (None = every leaf)
+def cluster_window(window):
+    thresholds,method,min_size = SETTINGS; keep = None
+    if window is not None:
+        keep = array('b', [0])*len(TREE)
+        for u in window_taxa(TIMES, *window):
+            keep[u] = 1
+    count,mrca,stat = clade_stats(TREE, keep, method)
+    return [threshold_clusters(TREE, count, mrca, stat, t, min_size) for t in thresholds]
+
+# yield the clusterings of every threshold in every window (in window order), sharing one parse (and optionally a process pool)
+def cluster_windows(tree, windows, thresholds, method='max_clade', min_size=2, processes=1):
+    times = None if windows == [None] else leaf_times(tree); args = (tree,times,thresholds,method,min_size)
+    if processes == 1:
+        init_cluster_worker(*args)
+        for w in windows:
+            yield cluster_window(w)
+    else:
+        with Pool(processes, initializer=init_cluster_worker, initargs=args) as pool:
+            for out in pool.imap(cluster_window, windows):
+                yield out
+
+# write one clustering in the Cluster Picker format
+def write_clustering(output, tree, leaves, numbers):
+    output.write('SequenceName\tClusterNumber\n')
+    for u,c in zip(leaves,numbers):
+        output.write('%s\t%d\n' % (tree.get_label(u).replace("'",''),c))
+
+# run main program
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--tree', required=False, type=str, default='stdin', help="Input Tree File")
+    parser.add_argument('-T', '--thresholds', required=True, type=float, nargs='+', help="Clustering Threshold(s)")
+    parser.add_argument('-m', '--method', required=False, type=str, default='max_clade', choices=METHODS, help="Clustering Method")
+    parser.add_argument('-ms', '--min_size', required=False, type=int, default=2, help="Minimum Cluster Size")
+    parser.add_argument('-s', '--start', required=False, type=float, default=float('-inf'), help="Window Start Time")
+    parser.add_argument('-e', '--end', required=False, type=float, default=float('inf'), help="Window End Time")
+    parser.add_argument('-w', '--windows', required=False, type=str, default=None, help="Window File (one 'start end' pair per line, each window [start,end); overrides -s/-e)")
+    parser.add_argument('-W', '--width', required=False, type=float, default=None, help="Sliding Window Width (windows [s,s+width) from -s to -e, the last one closed)")
+    parser.add_argument('-S', '--step', required=False, type=float, default=None, help="Sliding Window Step (default: window width)")
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1, help="Number of Worker Processes")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (reuse the parsed tree across runs; requires a tree file)")
+    parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File (with several windows/thresholds: prefix of one file per window and threshold)")
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    args = parser.parse_args(); prof = enable_profiling(args.profile)
+    assert args.min_size >= 1, "Minimum cluster size must be a positive integer"
+    if args.windows is None and args.width is None and args.start == float('-inf') and args.end == float('inf'):
+        windows = [None] # no window: leaf labels need not have times
+    else:
+        windows = window_list(args.windows, args.start, args.end, args.width, args.step)
+    single = len(windows) == 1 and len(args.thresholds) == 1
+    assert single or args.output != 'stdout', "Several windows or thresholds require an output prefix"
+    with prof.phase('parse_tree'):
+        if args.tree.lower() == 'stdin':
+            assert args.cache is None, "Caching requires a tree file"
+            from sys import stdin; tree = read_tree_compact(stdin.read())
+        elif args.cache is not None:
+            tree = load_tree_names(args.tree,open_cache(args.cache))[0]
+        else:
+            tree = read_tree_compact(args.tree)
+    with prof.phase('cluster_windows'): # includes writing each clustering
+        for w,clusterings in zip(windows, cluster_windows(tree, windows, args.thresholds, args.method, args.min_size, args.processes)):
+            for t,(leaves,numbers) in zip(args.thresholds, clusterings):
+                if single and args.output == 'stdout':
+                    from sys import stdout; output = stdout
+                elif single:
+                    output = open(args.output,'w')
+                elif w is None:
+                    output = open('%s.%g.txt' % (args.output,t),'w')
+                else:
+                    output = open('%s.%g-%g.%g.txt' % (args.output,w[0],w[1],t),'w')
+                write_clustering(output, tree, leaves, numbers); output.close(); prof.count('clusterings')
@@ -3,59 +3,131 @@
 Given a tree T, a start time S, and an end time E, remove all leaves from T that
 are outside of the time window [S,E]. Trees must be in the Newick format, and
 leaf labels must be delimited by the '|' character, with the last field being
-the time associated with the leaf.
+the time associated with the leaf. Many windows can be extracted from a single
+parse of T (one output tree per line, in window order).
 '''
-from dendropy import Node,Tree
-from queue import Queue
+from array import array
+from common import CompactTree,enable_profiling,load_tree_names,open_cache,read_tree_compact
+from math import isnan
+from multiprocessing import Pool
 
-# get the label of Dendropy node u
-def label(u):
-    return str(u.taxon).replace("'",'')
+# add edge lengths (missing + x = x)
+def add_lengths(a, b):
+    if isnan(a):
+        return b
+    if isnan(b):
+        return a
+    return a + b
 
-# my own version of extract_tree_with_taxa
+# time of each leaf (last '|'-delimited field of its label)
+def leaf_times(tree):
+    return {l:float(tree.get_label(l).split('|')[-1]) for l in tree.traverse_leaves()}
+
+# my own version of extract_tree_with_taxa: one postorder pass counts kept children (and folds unifurcations into their child edge), one
+# preorder pass writes the pruned tree
 def extract_tree_with_taxa(tree, taxa, suppress_unifurcations=True):
-    taxon_to_leaf = {}
-    for n in tree.preorder_node_iter():
-        n.keep = False
-        if n.is_leaf():
-            taxon_to_leaf[n.taxon] = n
-    for t in taxa:
-        for n in taxon_to_leaf[t].ancestor_iter(inclusive=True):
-            n.keep = True
-    out = Tree()
-    q_old = Queue(); q_old.put(tree.seed_node)
-    q_new = Queue(); q_new.put(out.seed_node)
-    while not q_old.empty():
-        n_old = q_old.get(); n_new = q_new.get()
-        for c_old in n_old.child_node_iter():
-            if c_old.keep:
-                c_new = Node(taxon=c_old.taxon, label=c_old.label, edge_length=c_old.edge_length); n_new.add_child(c_new)
-                q_old.put(c_old); q_new.put(c_new)
-    if suppress_unifurcations:
-        out.suppress_unifurcations()
-    return out
+    kept_children = array('l', [0])*len(tree); keep = array('b', [0])*len(tree)
+    for u in taxa:
+        keep[u] = 1
+    for u in tree.traverse_postorder():
+        if keep[u] and u != 0:
+            p = tree.parent[u]; keep[p] = 1; kept_children[p] += 1
+    el = array('d', tree.edge_length); el[0] = float('nan'); down = dict() # down[u] = kept node that takes the place of suppressed node u
+    for u in tree.traverse_postorder():
+        if suppress_unifurcations and keep[u] and kept_children[u] == 1:
+            c = next(c for c in tree.child_iter(u) if keep[c]); c = down.get(c,c)
+            down[u] = c; el[c] = add_lengths(el[c], el[u])
+    parent = array('l'); edge_length = array('d'); label = array('l'); new_ind = array('l', [-1])*len(tree)
+    for u in tree.traverse_preorder():
+        if not keep[u]:
+            continue
+        if u == 0:
+            p = -1
+        else:
+            p = new_ind[tree.parent[u]]
+        if u in down:
+            new_ind[u] = p
+        else:
+            new_ind[u] = len(parent); parent.append(p); edge_length.append(el[u])
+            if u == 0: # the root is rebuilt without its label and edge length
+                label.append(-1)
+            else:
+                label.append(tree.label[u])
+    return CompactTree(parent, edge_length, label, tree.labels)
+
+# leaves inside a window: strictly inside (start,end) by default (the single -s/-e window), or with bounds '[)' (half-open) or '[]' (closed)
+def window_taxa(times, start, end, bounds='()'):
+    if bounds == '[)':
+        return [l for l,t in times.items() if start <= t < end]
+    if bounds == '[]':
+        return [l for l,t in times.items() if start <= t <= end]
+    return [l for l,t in times.items() if start < t < end]
+
+# (start,end,bounds) windows from a window file (one 'start end' pair per line) or sliding windows of the given width (and step), which are
+# half-open [start,end) (the last sliding window is closed) so consecutive windows share no boundary leaves, or the single window (start,end)
+def window_list(windows_file=None, start=float('-inf'), end=float('inf'), width=None, step=None):
+    if windows_file is not None:
+        return [tuple(float(x) for x in l.split()) + ('[)',) for l in open(windows_file).read().strip().splitlines()]
+    if width is not None:
+        assert start != float('-inf') and end != float('inf'), "Sliding windows require both start time and end time"
+        if step is None:
+            step = width
+        windows = list(); s = start
+        while s < end:
+            windows.append((s,min(s+width,end),'[)' if s+width < end else '[]')); s += step
+        return windows
+    return [(start,end,'()')]
+
+# pool worker: the parsed tree and leaf times are sent once per worker process
+def init_window_worker(tree, times):
+    global TREE,TIMES; TREE = tree; TIMES = times
+
+def window_newick(window):
+    return extract_tree_with_taxa(TREE, window_taxa(TIMES,*window)).newick()
+
+# Newick strings of the tree restricted to each (start,end) window, sharing one parse (and optionally a process pool)
+def extract_windows(tree, windows, processes=1):
+    times = leaf_times(tree)
+    if processes == 1:
+        init_window_worker(tree, times)
+        for w in windows:
+            yield window_newick(w)
+    else:
+        with Pool(processes, initializer=init_window_worker, initargs=(tree,times)) as pool:
+            for s in pool.imap(window_newick, windows):
+                yield s
 
 # run main program
 if __name__ == "__main__":
-    import argparse; from gzip import open as gopen
+    import argparse
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-t', '--tree', required=False, type=str, default='stdin', help="Input Tree File")
     parser.add_argument('-s', '--start', required=False, type=float, default=float('-inf'), help="Window Start Time")
     parser.add_argument('-e', '--end', required=False, type=float, default=float('inf'), help="Window End Time")
+    parser.add_argument('-w', '--windows', required=False, type=str, default=None, help="Window File (one 'start end' pair per line, each window [start,end); overrides -s/-e)")
+    parser.add_argument('-W', '--width', required=False, type=float, default=None, help="Sliding Window Width (windows [s,s+width) from -s to -e, the last one closed)")
+    parser.add_argument('-S', '--step', required=False, type=float, default=None, help="Sliding Window Step (default: window width)")
+    parser.add_argument('-p', '--processes', required=False, type=int, default=1, help="Number of Worker Processes")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (reuse the parsed tree across runs; requires a tree file)")
     parser.add_argument('-o', '--output', required=False, type=str, default='stdout', help="Output File")
-    args = parser.parse_args()
-    assert args.start != float('-inf') or args.end != float('inf'), "Must specify either start time or end time (or both)"
-    if args.tree.lower() == 'stdin':
-        from sys import stdin; tree = Tree.get(data=stdin.read(),schema='newick')
-    elif args.tree.lower().endswith('.gz'):
-        tree = Tree.get(data=gopen(args.tree).read().decode(),schema='newick')
-    else:
-        tree = Tree.get(data=open(args.tree).read(),schema='newick')
+    parser.add_argument('-P', '--profile', required=False, type=str, default=None, help="Output Profile File (JSON: per-phase timings and peak RSS)")
+    args = parser.parse_args(); prof = enable_profiling(args.profile)
+    if args.windows is None and args.width is None:
+        assert args.start != float('-inf') or args.end != float('inf'), "Must specify either start time or end time (or both)"
+    windows = window_list(args.windows, args.start, args.end, args.width, args.step)
+    with prof.phase('parse_tree'):
+        if args.tree.lower() == 'stdin':
+            assert args.cache is None, "Caching requires a tree file"
+            from sys import stdin; tree = read_tree_compact(stdin.read())
+        elif args.cache is not None:
+            tree = load_tree_names(args.tree,open_cache(args.cache))[0]
+        else:
+            tree = read_tree_compact(args.tree)
     if args.output == 'stdout':
         from sys import stdout; output = stdout
     else:
         output = open(args.output,'w')
-    taxa = [leaf.taxon for leaf in tree.leaf_node_iter() if args.start < float(label(leaf).split('|')[-1]) < args.end]
-    #output.write((tree.extract_tree_with_taxa(taxa, suppress_unifurcations=False).as_string('newick')))
-    output.write(extract_tree_with_taxa(tree,taxa).as_string('newick').replace("'",''))
-    output.write('\n'); output.close()
\ No newline at end of file
+    with prof.phase('extract_windows'): # includes writing each window's tree
+        for s in extract_windows(tree, windows, args.processes):
+            output.write(s.replace("'",'')); output.write('\n'); prof.count('windows')
+    output.close()
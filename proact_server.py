@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+ProACT prioritization service: keeps the tree, the diagnosis times, the ProACT
+ranking, and per-leaf tree features in memory and answers local HTTP queries
+(asyncio, on a TCP port or a Unix socket), so each query costs a lookup instead
+of a new process that re-parses the tree. All responses are JSON.
+
+  GET  /top?n=N                    top N individuals (all if n is omitted)
+  GET  /rank?individual=X          1-based rank of X (leaf label or person name)
+  GET  /features?individual=X      leaf_stats features of X (plus rank and diagnosis)
+  GET  /status                     loaded files, snapshot version, reload state
+  POST /reload[?tree=F&diagnosis=D] rebuild (optionally from new files) in the background
+
+Reloads build a new snapshot in a worker process and swap it in atomically once
+it is ready, so queries keep being answered from the previous snapshot.
+'''
+from asyncio import get_running_loop,run,sleep,start_server,start_unix_server
+from concurrent.futures import ProcessPoolExecutor
+from compact_tree import person_name,read_tree_compact
+from json import dumps
+from os.path import abspath,dirname,getmtime,join
+from sys import path,stderr
+from time import time
+from tree_cache import TreeCache
+from urllib.parse import parse_qs,urlsplit
+from ProACT import check_diagnosis,load_cached_tree,prioritize,read_diagnosis
+path.append(join(dirname(abspath(__file__)), 'helper_scripts'))
+from leaf_stats import compute_columns
+FEATURES = ['edge_length', 'root_to_tip', 'root_to_tip_u', 'sib_leaves', 'closest_leaf']
+STATUS = {200:'OK', 202:'Accepted', 400:'Bad Request', 404:'Not Found', 405:'Method Not Allowed', 409:'Conflict', 500:'Internal Server Error'}
+
+class Snapshot:
+    '''Immutable ranking of one tree: order (leaf labels by priority), rank of each leaf label and person name, and feature columns'''
+    def __init__(self, tree_file, diag_file, order, features, diag, version=0):
+        self.tree_file = tree_file; self.diag_file = diag_file; self.order = order; self.features = features; self.diag = diag
+        self.version = version; self.loaded_at = time(); self.rank = dict(); self.leaf = dict() # leaf[label or person name] = row in features
+        for r,l in enumerate(order):
+            self.rank[l] = r+1
+        for i,l in enumerate(features['label']):
+            self.leaf[l] = i; self.leaf.setdefault(person_name(l), i)
+
+    # leaf label of an individual given by leaf label or person name (None if absent)
+    def label(self, individual):
+        i = self.leaf.get(individual)
+        if i is None:
+            return None
+        return self.features['label'][i]
+
+    def top(self, n=None):
+        if n is None:
+            return self.order
+        return self.order[:n]
+
+    def leaf_features(self, individual):
+        i = self.leaf.get(individual)
+        if i is None:
+            return None
+        out = {k:self.features[k][i] for k in ['label']+FEATURES}; out['rank'] = self.rank[out['label']]
+        if self.diag is not None:
+            out['diagnosis'] = self.diag[out['label']]
+        return out
+
+# parse, rank, and compute features of a tree (runs in a worker process during reloads)
+def build_snapshot(tree_file, diag_file=None, cache_dir=None, version=0):
+    cache = None if cache_dir is None else TreeCache(cache_dir); diag = None
+    if diag_file is not None:
+        diag = read_diagnosis(diag_file,cache)
+    if cache is None:
+        tree = read_tree_compact(tree_file); keys = None
+    else:
+        tree,keys = load_cached_tree(tree_file,cache)
+    if diag is not None:
+        check_diagnosis(tree,diag)
+    features = compute_columns(tree); features['label'] = [tree.get_label(l) for l in tree.traverse_leaves()]
+    return Snapshot(tree_file, diag_file, prioritize(tree,'All',diag,keys), features, diag, version)
+
+class ProACTServer:
+    '''Serves queries from the current snapshot; reload() swaps in a new one built in a worker process'''
+    def __init__(self, snapshot, cache_dir=None):
+        self.snapshot = snapshot; self.cache_dir = cache_dir; self.reloading = None; self.last_error = None; self.executor = ProcessPoolExecutor(1)
+
+    # start a background rebuild (returns False if one is already running)
+    def reload(self, tree_file=None, diag_file=None):
+        if self.reloading is not None:
+            return False
+        old = self.snapshot; tree_file = tree_file or old.tree_file; diag_file = diag_file or old.diag_file
+        future = get_running_loop().run_in_executor(self.executor, build_snapshot, tree_file, diag_file, self.cache_dir, old.version+1)
+        self.reloading = future; future.add_done_callback(self.swap)
+        return True
+
+    def swap(self, future):
+        self.reloading = None
+        try:
+            self.snapshot = future.result(); self.last_error = None
+            stderr.write("Loaded snapshot %d (%d leaves)\n" % (self.snapshot.version, len(self.snapshot.order)))
+        except Exception as e: # keep serving the old snapshot
+            self.last_error = '%s: %s' % (type(e).__name__,e); stderr.write("Reload failed: %s\n" % self.last_error)
+
+    # reload whenever the tree or diagnosis file changes (checked every `interval` seconds)
+    async def watch(self, interval):
+        def mtimes():
+            s = self.snapshot; return [getmtime(f) for f in (s.tree_file,s.diag_file) if f is not None]
+        last = mtimes()
+        while True:
+            await sleep(interval)
+            try:
+                now = mtimes()
+            except OSError: # file is being replaced
+                continue
+            if now != last and self.reload():
+                last = now
+
+    # (status code, JSON-serializable body) of one request
+    def handle(self, method, target):
+        url = urlsplit(target); query = {k:v[-1] for k,v in parse_qs(url.query).items()}; s = self.snapshot # one snapshot per request
+        if url.path == '/reload':
+            if method != 'POST':
+                return 405, {'error':'use POST'}
+            if not self.reload(query.get('tree'), query.get('diagnosis')):
+                return 409, {'error':'reload already in progress'}
+            return 202, {'reloading':True, 'version':s.version}
+        if method != 'GET':
+            return 405, {'error':'use GET'}
+        if url.path == '/top':
+            try:
+                n = int(query['n']) if 'n' in query else None
+            except ValueError:
+                return 400, {'error':'n must be an integer'}
+            if n is not None and n < 0:
+                return 400, {'error':'n must be non-negative'}
+            return 200, {'version':s.version, 'individuals':s.top(n)}
+        if url.path in ('/rank','/features'):
+            if 'individual' not in query:
+                return 400, {'error':'missing individual'}
+            u = query['individual']; label = s.label(u)
+            if label is None:
+                return 404, {'error':'individual not in tree: %s' % u}
+            if url.path == '/rank':
+                return 200, {'version':s.version, 'individual':u, 'label':label, 'rank':s.rank[label], 'num_individuals':len(s.order)}
+            return 200, dict(version=s.version, individual=u, **s.leaf_features(u))
+        if url.path == '/status':
+            return 200, {'version':s.version, 'tree':s.tree_file, 'diagnosis':s.diag_file, 'num_individuals':len(s.order),
+                         'loaded_at':s.loaded_at, 'reloading':self.reloading is not None, 'last_error':self.last_error}
+        return 404, {'error':'unknown path: %s' % url.path}
+
+    # HTTP/1.1 connection (keep-alive unless the client asks to close)
+    async def client(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if len(request) == 0:
+                    break
+                headers = dict()
+                while True:
+                    l = await reader.readline()
+                    if l in (b'\r\n', b'\n', b''):
+                        break
+                    k,_,v = l.decode('latin-1').partition(':'); headers[k.strip().lower()] = v.strip()
+                if 'content-length' in headers:
+                    await reader.readexactly(int(headers['content-length']))
+                try:
+                    method,target,version = request.decode('latin-1').split()
+                    code,body = self.handle(method.upper(), target)
+                except ValueError:
+                    code,body = 400, {'error':'malformed request'}
+                except Exception as e:
+                    code,body = 500, {'error':'%s: %s' % (type(e).__name__,e)}
+                keep_alive = headers.get('connection','').lower() != 'close' and request.rstrip().endswith(b'HTTP/1.1')
+                data = dumps(body).encode()
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (code, STATUS[code].encode(), len(data), b'keep-alive' if keep_alive else b'close'))
+                writer.write(data); await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError,EOFError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(server, host='127.0.0.1', port=8080, unix_socket=None, watch_interval=None):
+    if unix_socket is None:
+        srv = await start_server(server.client, host, port); where = '%s:%d' % (host,port)
+    else:
+        srv = await start_unix_server(server.client, unix_socket); where = unix_socket
+    stderr.write("Serving %d individuals on %s\n" % (len(server.snapshot.order), where))
+    if watch_interval is not None:
+        get_running_loop().create_task(server.watch(watch_interval))
+    async with srv:
+        await srv.serve_forever()
+
+# run main program
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--tree', required=True, type=str, help="Input Tree File (Newick format)")
+    parser.add_argument('-d', '--diagnosis', required=False, type=str, default=None, help="Diagnosis File (TSV format)")
+    parser.add_argument('-H', '--host', required=False, type=str, default='127.0.0.1', help="Host to Listen on")
+    parser.add_argument('-p', '--port', required=False, type=int, default=8080, help="Port to Listen on")
+    parser.add_argument('-u', '--unix_socket', required=False, type=str, default=None, help="Unix Socket to Listen on (instead of host/port)")
+    parser.add_argument('-w', '--watch', required=False, type=float, default=None, help="Reload when the tree/diagnosis file changes (check every this many seconds)")
+    parser.add_argument('-c', '--cache', required=False, type=str, default=None, help="Cache Directory (see ProACT.py)")
+    args = parser.parse_args()
+    server = ProACTServer(build_snapshot(args.tree, args.diagnosis, args.cache), args.cache)
+    try:
+        run(serve(server, args.host, args.port, args.unix_socket, args.watch))
+    except KeyboardInterrupt:
+        pass
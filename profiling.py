@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+'''
+Profiling hooks shared by ProACT.py and the helper scripts. Library code asks
+for the active profiler with get_profiler() and wraps its phases in
+profiler.phase(name); unless a Profiler is installed (set_profiler, profiling,
+or enable_profiling), that is a no-op. A Profiler records per-phase wall times
+(nested phases are named "outer/inner"), counters, summary statistics of
+observed values, and peak RSS, calls user hooks when a phase ends, and writes
+everything as JSON.
+'''
+from contextlib import contextmanager,nullcontext
+from json import dump
+from sys import argv,platform
+from time import perf_counter
+
+# peak resident set size of this process in MB (None if the resource module is unavailable)
+def peak_rss_mb():
+    try:
+        from resource import RUSAGE_SELF,getrusage
+    except ImportError:
+        return None
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    if platform == 'darwin': # bytes on macOS, KB on Linux
+        return rss/1048576
+    return rss/1024
+
+class Profiler:
+    '''Per-phase wall times, counters, and value statistics; hook(name, seconds) is called whenever a phase ends'''
+    enabled = True
+    def __init__(self, hooks=(), count_comparisons=False):
+        self.hooks = list(hooks); self.count_comparisons = count_comparisons; self.start = perf_counter(); self.stack = list()
+        self.phases = dict(); self.counters = dict(); self.stats = dict()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    # time the enclosed block as phase `name` (repeated phases are summed)
+    @contextmanager
+    def phase(self, name):
+        self.stack.append(name); name = '/'.join(self.stack); start = perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = perf_counter()-start; self.stack.pop()
+            if name not in self.phases:
+                self.phases[name] = {'calls':0, 'seconds':0.}
+            self.phases[name]['calls'] += 1; self.phases[name]['seconds'] += seconds
+            for hook in self.hooks:
+                hook(name, seconds)
+
+    def count(self, name, k=1):
+        self.counters[name] = self.counters.get(name,0) + k
+
+    # add values to the (count, total, min, max) summary of `name`
+    def observe(self, name, values):
+        if name not in self.stats:
+            self.stats[name] = {'count':0, 'total':0, 'min':None, 'max':None}
+        s = self.stats[name]
+        for x in values:
+            s['count'] += 1; s['total'] += x
+            if s['min'] is None or x < s['min']:
+                s['min'] = x
+            if s['max'] is None or x > s['max']:
+                s['max'] = x
+
+    def report(self):
+        stats = {k:dict(v, mean=(v['total']/v['count'] if v['count'] != 0 else None)) for k,v in self.stats.items()}
+        return {'command':argv, 'total_seconds':perf_counter()-self.start, 'peak_rss_mb':peak_rss_mb(),
+                'phases':[dict(name=k, **v) for k,v in self.phases.items()], 'counters':self.counters, 'stats':stats}
+
+    def write(self, filename):
+        with open(filename,'w') as f:
+            dump(self.report(), f, indent=1); f.write('\n')
+
+class NullProfiler:
+    '''Profiler that records nothing (the default)'''
+    enabled = False; count_comparisons = False
+    def phase(self, name):
+        return nullcontext(self)
+
+    def count(self, name, k=1):
+        pass
+
+    def observe(self, name, values):
+        pass
+
+NULL_PROFILER = NullProfiler(); PROFILER = NULL_PROFILER
+
+def get_profiler():
+    return PROFILER
+
+# install a profiler (None = disable profiling) and return the previous one
+def set_profiler(profiler):
+    global PROFILER; old = PROFILER; PROFILER = NULL_PROFILER if profiler is None else profiler
+    return old
+
+# profile the enclosed block: with profiling() as p: ...; p.report()
+@contextmanager
+def profiling(hooks=(), count_comparisons=False):
+    p = Profiler(hooks, count_comparisons); old = set_profiler(p)
+    try:
+        yield p
+    finally:
+        set_profiler(old)
+
+# command-line --profile: install a profiler whose JSON report is written to filename at exit (no-op if filename is None)
+def enable_profiling(filename, count_comparisons=False):
+    if filename is None:
+        return NULL_PROFILER
+    from atexit import register
+    p = Profiler(count_comparisons=count_comparisons); set_profiler(p); register(p.write, filename)
+    return p
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+'''
+Opt-in on-disk cache of parsed inputs. Each entry is a single memory-mappable
+binary file named by the SHA-256 of the input file's content, holding named
+sections (typed arrays or lists of strings). Arrays are read through mmap
+without copying, every hit refreshes the entry's modification time, and entries
+beyond the cache size are evicted least recently used first. A changed input
+has a different hash, so stale entries are never read and simply age out.
+'''
+from array import array
+from compact_tree import CompactTree,person_name,read_tree_compact
+from gzip import open as gopen
+from hashlib import sha256
+from json import dumps,loads
+from mmap import ACCESS_READ,mmap
+from os import fdopen,listdir,makedirs,remove,replace,utime
+from os.path import expanduser,getmtime,isfile,join
+from struct import pack,unpack
+from tempfile import mkstemp
+MAGIC = b'PROACTC2' # bumped when the layout or leaf order of cached sections changes
+
+# bytes of padding needed to align n to 8 bytes
+def pad(n):
+    return -n % 8
+
+# remove a file if it still exists (another process may have removed it first)
+def discard(fn):
+    try:
+        remove(fn)
+    except OSError:
+        pass
+
+class TreeCache:
+    '''Directory of cache entries, keyed by (kind, content hash of the input file)'''
+    def __init__(self, directory, max_entries=16):
+        self.directory = expanduser(directory); self.max_entries = max_entries; makedirs(self.directory, exist_ok=True)
+
+    # entry file name of an input file: kind + SHA-256 of its content (read in chunks)
+    def key(self, filename, kind):
+        h = sha256()
+        with open(expanduser(filename),'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''):
+                h.update(chunk)
+        return '%s-%s.bin' % (kind, h.hexdigest())
+
+    # {name: section} of an entry (None on a miss; unreadable entries are deleted)
+    def load(self, key):
+        fn = join(self.directory, key)
+        if not isfile(fn):
+            return None
+        try:
+            with open(fn,'rb') as f:
+                mm = mmap(f.fileno(), 0, access=ACCESS_READ)
+            if len(mm) < 16 or mm[:8] != MAGIC:
+                raise ValueError("Invalid cache entry: %s" % fn)
+            head_len, = unpack('<Q', mm[8:16]); header = loads(mm[16:16+head_len].decode()); start = 16 + head_len + pad(16+head_len)
+            data = memoryview(mm); sections = dict()
+            for name,(typecode,offset,length) in header.items():
+                offset += start
+                if offset+length > len(mm) or (typecode != 's' and length % array(typecode).itemsize != 0): # truncated entry
+                    raise ValueError("Invalid cache entry: %s" % fn)
+                if typecode == 's':
+                    sections[name] = bytes(data[offset:offset+length]).decode().split('\0') if length != 0 else list()
+                else:
+                    sections[name] = data[offset:offset+length].cast(typecode)
+        except (OSError,TypeError,ValueError,UnicodeDecodeError):
+            discard(fn); return None
+        try:
+            utime(fn)
+        except OSError: # evicted by another process since it was mapped (the mapping stays valid)
+            pass
+        return sections
+
+    # write an entry atomically (uniquely named temporary file + rename, so concurrent writers of the same entry never share a file), then
+    # evict the least recently used entries. A failed rename (e.g. another process holds the entry open) just leaves this run uncached
+    def store(self, key, sections):
+        header = dict(); blobs = list(); offset = 0
+        for name,x in sections.items():
+            if isinstance(x,list):
+                typecode = 's'; blob = '\0'.join(x).encode()
+            else:
+                typecode = getattr(x, 'typecode', None) or x.format; blob = array(typecode, x).tobytes()
+            header[name] = (typecode,offset,len(blob)); blobs.append(blob); offset += len(blob) + pad(len(blob))
+        head = dumps(header).encode(); fn = join(self.directory, key); fd,tmp = mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with fdopen(fd,'wb') as f:
+                f.write(MAGIC); f.write(pack('<Q', len(head))); f.write(head); f.write(b'\0'*pad(16+len(head)))
+                for blob in blobs:
+                    f.write(blob); f.write(b'\0'*pad(len(blob)))
+            replace(tmp, fn)
+        except OSError:
+            discard(tmp); return
+        self.evict()
+
+    # keep only the max_entries most recently used entries (entries removed concurrently by another process are skipped)
+    def evict(self):
+        entries = list()
+        for fn in listdir(self.directory):
+            if fn.endswith('.bin'):
+                try:
+                    entries.append((getmtime(join(self.directory,fn)),fn))
+                except OSError:
+                    pass
+        for _,fn in sorted(entries, reverse=True)[self.max_entries:]:
+            discard(join(self.directory,fn))
+
+# cache sections of a tree: its flat arrays plus the leaf names (aligned with tree.traverse_leaves()) after person-name normalization
+def tree_sections(tree):
+    return {'parent':tree.parent, 'edge_length':tree.edge_length, 'label':tree.label, 'child_start':tree.child_start, 'children':tree.children,
+            'labels':list(tree.labels), 'names':[person_name(tree.get_label(l)) for l in tree.traverse_leaves()]}
+
+def tree_from_sections(sections):
+    return CompactTree(sections['parent'], sections['edge_length'], sections['label'], sections['labels'], sections['child_start'], sections['children'])
+
+# (tree, leaf names, entry) of a Newick file, parsed only on a cache miss (cache = None disables caching)
+def load_tree(filename, cache=None):
+    if cache is None:
+        tree = read_tree_compact(filename); return tree,[person_name(tree.get_label(l)) for l in tree.traverse_leaves()],None
+    key = cache.key(filename,'tree'); entry = cache.load(key)
+    if entry is None:
+        entry = tree_sections(read_tree_compact(filename)); cache.store(key, entry)
+    entry['key'] = key
+    return tree_from_sections(entry),entry['names'],entry
+
+# add sections (e.g. precomputed priority keys) to an entry returned by load_tree
+def extend_entry(cache, entry, sections):
+    key = entry.pop('key'); entry.update(sections); cache.store(key, entry); entry['key'] = key
+
+# (names, values) columns of a "name<TAB>number" file such as diagnosis times (raw names; later lines override earlier ones when zipped into a dict)
+def read_table(filename):
+    names = list(); values = array('d')
+    with (gopen(expanduser(filename),'rt') if filename.lower().endswith('.gz') else open(expanduser(filename))) as f:
+        for l in f:
+            if len(l.strip()) != 0:
+                try:
+                    u,t = l.split('\t'); t = float(t)
+                except:
+                    raise RuntimeError("Invalid diagnosis time file (not TSV)")
+                names.append(u.strip()); values.append(t)
+    return names,values
+
+# (names, values) columns of a table file parsed by parse (read_table by default) only on a cache miss. Each parser needs its own kind, so
+# the cache never changes which inputs are accepted or how they are read
+def load_table(filename, cache=None, parse=read_table, kind='table'):
+    if cache is None:
+        return parse(filename)
+    key = cache.key(filename,kind); entry = cache.load(key)
+    if entry is None:
+        names,values = parse(filename); entry = {'names':list(names), 'values':array('d',values)}; cache.store(key, entry)
+    return entry['names'],entry['values']